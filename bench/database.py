@@ -0,0 +1,84 @@
+"""Throwaway SQLite database standing in for MySQL.
+
+The bot's queries are plain enough to run on SQLite once the %s
+placeholders are swapped for ?, so the real ConnectionPool is driven with
+a connect factory from here instead of MySQLdb.
+"""
+import sqlite3
+import threading
+from decimal import Decimal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS JaduGPT (User TEXT, UserID TEXT, Cost TEXT, Datetime TEXT);
+CREATE TABLE IF NOT EXISTS JaduThreads (Date TEXT, UserID TEXT, allowed TEXT);
+CREATE TABLE IF NOT EXISTS JaduBlockedUsers (
+    Moderator TEXT, BlockedUserID TEXT, DateTime TEXT, IsBlocked INTEGER
+);
+"""
+
+# ledger costs are Decimals, MySQLdb writes them as strings and so do we
+sqlite3.register_adapter(Decimal, str)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+
+class _Cursor:
+    def __init__(self, cursor: sqlite3.Cursor, queries: QueryCounter):
+        self._cursor = cursor
+        self._queries = queries
+
+    def execute(self, sql: str, args=None) -> int:
+        self._queries.add()
+        self._cursor.execute(sql.replace("%s", "?"), tuple(args or ()))
+        return self._cursor.rowcount
+
+    def executemany(self, sql: str, rows) -> int:
+        self._queries.add()
+        self._cursor.executemany(sql.replace("%s", "?"), [tuple(r) for r in rows])
+        return self._cursor.rowcount
+
+    def fetchall(self):
+        return tuple(self._cursor.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class _Connection:
+    def __init__(self, path: str, queries: QueryCounter):
+        # the pool hands connections between its worker threads
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._queries = queries
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self._connection.cursor(), self._queries)
+
+    def commit(self):
+        self._connection.commit()
+
+    def ping(self):
+        self._connection.execute("SELECT 1")
+
+    def close(self):
+        self._connection.close()
+
+
+def create(path: str):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    connection.commit()
+    connection.close()
+
+
+def connect_factory(path: str, queries: QueryCounter):
+    """A connect callable for ConnectionPool that opens SQLite connections to path."""
+    return lambda: _Connection(path, queries)
@@ -0,0 +1,234 @@
+"""In-memory stand-ins for the Discord objects the handlers touch.
+
+Threads and channels subclass the real discord.py classes so the handlers'
+isinstance checks pass, but nothing here talks to Discord. Sending a message
+records it with a timestamp and feeds it back to the bot's on_message, the
+way the gateway would.
+"""
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+import discord
+
+_ids = itertools.count(1_100_000_000_000_000_000)
+
+Dispatch = Callable[[str, object], None]
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeUser:
+    def __init__(self, name: str, moderator: bool = False, id: Optional[int] = None):
+        self.id = id or next_id()
+        self.name = name
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+        self.guild_permissions = discord.Permissions(manage_messages=moderator)
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+class FakeGuild:
+    def __init__(self, id: Optional[int] = None):
+        self.id = id or next_id()
+        self.name = f"guild-{self.id}"
+
+    async def fetch_channel(self, channel_id: int):
+        return FakeTextChannel(self, name="moderation", dispatch=lambda *a: None, id=channel_id)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        channel,
+        author: FakeUser,
+        content: str = "",
+        embeds: Optional[list] = None,
+    ):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ""
+        self.embeds = embeds or []
+        self.type = discord.MessageType.default
+        self.reference = None
+        self.jump_url = f"https://discord.test/{channel.guild.id}/{channel.id}/{self.id}"
+        self.deleted = False
+
+    async def edit(self, content: Optional[str] = None, **kwargs):
+        if content is not None:
+            self.content = content
+        self.channel.record("edit", self)
+        self.channel.dispatch(
+            "raw_message_edit",
+            SimpleNamespace(
+                channel_id=self.channel.id, message_id=self.id, data={"content": content}
+            ),
+        )
+        return self
+
+    async def delete(self):
+        self.deleted = True
+        self.channel.remove(self)
+        self.channel.dispatch(
+            "raw_message_delete",
+            SimpleNamespace(channel_id=self.channel.id, message_id=self.id),
+        )
+
+
+@dataclass
+class Event:
+    at: float
+    kind: str  # "user", "send", "edit"
+    message: FakeMessage
+    bot: bool
+
+
+class _Channel:
+    """Message store shared by the fake thread and text channel."""
+
+    def _setup(self, guild: FakeGuild, name: str, dispatch: Dispatch, id: Optional[int]):
+        self.id = id or next_id()
+        self.guild = guild
+        self.name = name
+        self.dispatch = dispatch
+        self.bot_user: Optional[FakeUser] = None
+        self.messages: List[FakeMessage] = []
+        self.events: List[Event] = []
+        self.last_message: Optional[FakeMessage] = None
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.test/{self.guild.id}/{self.id}"
+
+    @property
+    def message_count(self) -> int:
+        return len(self.messages)
+
+    def record(self, kind: str, message: FakeMessage):
+        bot = self.bot_user is not None and message.author == self.bot_user
+        self.events.append(Event(time.perf_counter(), kind, message, bot))
+
+    def remove(self, message: FakeMessage):
+        if message in self.messages:
+            self.messages.remove(message)
+
+    def post(self, message: FakeMessage, kind: str):
+        self.messages.append(message)
+        self.last_message = message
+        self.record(kind, message)
+        self.dispatch("message", message)
+
+    def say(self, author: FakeUser, content: str) -> FakeMessage:
+        """A user writes in the channel."""
+        message = FakeMessage(self, author, content)
+        self.post(message, "user")
+        return message
+
+    async def send(self, content: Optional[str] = None, embed=None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(0)
+        message = FakeMessage(self, self.bot_user, content or "", [embed] if embed else [])
+        self.post(message, "send")
+        return message
+
+    async def history(self, limit: Optional[int] = None, after=None, **kwargs):
+        messages = [m for m in reversed(self.messages) if after is None or m.id > after.id]
+        for message in messages[:limit]:
+            yield message
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class FakeThread(_Channel, discord.Thread):
+    # shadow the properties of discord.Thread that read gateway state
+    last_message = None
+    jump_url = _Channel.jump_url
+    message_count = _Channel.message_count
+
+    def __init__(self, parent: "FakeTextChannel", name: str, owner_id: int, dispatch: Dispatch):
+        self._setup(parent.guild, name, dispatch, None)
+        self.parent_id = parent.id
+        self.owner_id = owner_id
+        self.archived = False
+        self.locked = False
+        self.bot_user = parent.bot_user
+
+    async def edit(self, name: Optional[str] = None, archived=None, locked=None, **kwargs):
+        if name is not None:
+            self.name = name
+        if archived is not None:
+            self.archived = archived
+        if locked is not None:
+            self.locked = locked
+        return self
+
+    def __repr__(self) -> str:
+        return f"<FakeThread id={self.id} name={self.name!r}>"
+
+
+class FakeTextChannel(_Channel, discord.TextChannel):
+    last_message = None
+    jump_url = _Channel.jump_url
+    threads = None
+
+    def __init__(self, guild: FakeGuild, name: str, dispatch: Dispatch, id: Optional[int] = None):
+        self._setup(guild, name, dispatch, id)
+        self.threads: List[FakeThread] = []
+
+    async def create_thread(self, name: str, **kwargs) -> FakeThread:
+        await asyncio.sleep(0)
+        thread = FakeThread(self, name, self.bot_user.id, self.dispatch)
+        self.threads.append(thread)
+        return thread
+
+    def __repr__(self) -> str:
+        return f"<FakeTextChannel id={self.id} name={self.name!r}>"
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self.sent: List[FakeMessage] = []
+
+    async def send_message(self, content: Optional[str] = None, embed=None, **kwargs):
+        await asyncio.sleep(0)
+        message = FakeMessage(
+            self._interaction.channel,
+            self._interaction.channel.bot_user,
+            content or "",
+            [embed] if embed else [],
+        )
+        self.sent.append(message)
+
+
+class FakeInteraction:
+    def __init__(self, channel: _Channel, user: FakeUser):
+        self.id = next_id()
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = channel.guild
+        self.user = user
+        self.response = FakeResponse(self)
+
+    async def original_response(self) -> FakeMessage:
+        return self.response.sent[-1]
@@ -0,0 +1,382 @@
+"""Drives the bot's real handlers against the fakes, the upstream stub and SQLite.
+
+Environment variables are pointed at the stand-ins before anything under
+src is imported, since src.constants reads them at import time.
+"""
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from bench import database, upstream
+from bench.fakes import (
+    FakeGuild,
+    FakeInteraction,
+    FakeMessage,
+    FakeTextChannel,
+    FakeThread,
+    FakeUser,
+)
+
+QUESTIONS = [
+    "How do I reset my password?",
+    "Can you explain how staking works on the network?",
+    "What is the difference between a wallet and an exchange account?",
+    "Write a short summary of the last release notes.",
+    "Why is my transaction still pending after an hour?",
+    "Give me three tips to keep my account secure.",
+    "What does the error 'insufficient funds for gas' mean?",
+    "Translate 'good morning, team' into Spanish and French.",
+]
+
+
+@dataclass
+class Step:
+    at: float  # seconds from the start of the run
+    thread: str  # name of the thread in the trace, not a Discord id
+    user: str
+    text: str = ""
+    kind: str = "message"  # message, google (/google in the thread) or chat (/chat creating it)
+    guild: str = "default"
+
+
+def load_trace(path: str) -> List[Step]:
+    """Reads a JSON lines trace, one Step per line."""
+    with open(path) as f:
+        steps = [Step(**json.loads(line)) for line in f if line.strip()]
+    return sorted(steps, key=lambda s: s.at)
+
+
+def synthetic(threads: int, messages: int, think: float, seed: int = 0) -> List[Step]:
+    """One user per thread, writing with exponentially distributed think times."""
+    rng = random.Random(seed)
+    steps = []
+    for t in range(threads):
+        at = rng.uniform(0, think)
+        for _ in range(messages):
+            steps.append(Step(at=at, thread=f"t{t}", user=f"user{t}", text=rng.choice(QUESTIONS)))
+            at += rng.expovariate(1 / think)
+    return sorted(steps, key=lambda s: s.at)
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(0.50), 4),
+        "p95": round(rank(0.95), 4),
+        "p99": round(rank(0.99), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+class LoopMonitor:
+    """Measures how late the event loop wakes a task that sleeps in short steps."""
+
+    def __init__(self, interval: float = 0.01, stall_threshold: float = 0.1):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def summary(self) -> dict:
+        lags = percentiles(self.lags)
+        return {
+            "stalls": sum(lag > self.stall_threshold for lag in self.lags),
+            "stall_threshold_ms": self.stall_threshold * 1000,
+            "lag_p99_ms": round(lags.get("p99", 0) * 1000, 2),
+            "lag_max_ms": round(lags.get("max", 0) * 1000, 2),
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Upstream:
+    """The upstream stub, running in a child process."""
+
+    def __init__(self, config: upstream.UpstreamConfig):
+        self.config = config
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._process: Optional[multiprocessing.Process] = None
+
+    def start(self, timeout: float = 10):
+        # spawn, so the child does not inherit the running event loop
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=upstream.serve, args=(self.config, self.port), daemon=True
+        )
+        self._process.start()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Upstream stub did not start on port {self.port}")
+                time.sleep(0.05)
+
+    async def stats(self) -> Dict[str, int]:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.url}/_stats") as response:
+                return await response.json()
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+
+
+class Harness:
+    def __init__(self, upstream_url: str, history: int = 0, workdir: Optional[str] = None):
+        self.upstream_url = upstream_url
+        self.history = history  # messages already in each thread before the run
+        self.workdir = workdir or tempfile.mkdtemp(prefix="jadugpt-bench-")
+        self.queries = database.QueryCounter()
+        self.startup_queries = 0
+        self.monitor = LoopMonitor()
+        self.main = None
+        self.bot = FakeUser("JaduGPT")
+        self._users: Dict[str, FakeUser] = {}
+        self._guilds: Dict[str, FakeGuild] = {}
+        self._channels: Dict[str, FakeTextChannel] = {}
+        self._threads: Dict[str, "asyncio.Future[FakeThread]"] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.command_latencies: List[float] = []
+
+    def _environment(self):
+        os.environ["OPENAI_BASE_URL"] = f"{self.upstream_url}/v1"
+        os.environ["GOOGLE_CSE_URL"] = f"{self.upstream_url}/customsearch/v1"
+        os.environ["METRICS_PORT"] = "0"
+        os.environ.pop("PAGE_CACHE_DIR", None)
+        for name in (
+            "DISCORD_BOT_TOKEN",
+            "DISCORD_CLIENT_ID",
+            "OPENAI_API_KEY",
+            "GOOGLE_API_KEY",
+            "GOOGLE_CSE_ID",
+        ):
+            os.environ.setdefault(name, "bench")
+        os.environ.setdefault("ALLOWED_SERVER_IDS", "1")
+        os.environ.setdefault("SERVER_TO_MODERATION_CHANNEL", "1:1")
+
+    async def start(self):
+        self._environment()
+        from src import blocklist, db, ledger, main, spend, store, threadlimit
+
+        self.main = main
+        path = os.path.join(self.workdir, "bench.sqlite3")
+        database.create(path)
+        db.pool = db.ConnectionPool(
+            minsize=db.pool.minsize,
+            maxsize=db.pool.maxsize,
+            acquire_timeout=db.pool.acquire_timeout,
+            health_check_seconds=db.pool.health_check_seconds,
+            connect=database.connect_factory(path, self.queries),
+        )
+        # client.user is read only and normally filled in by the gateway login
+        main.client._connection.user = self.bot
+        await db.pool.start()
+        await blocklist.blocklist.start()
+        await spend.spend.start()
+        await threadlimit.thread_limiter.start()
+        await store.store.start()
+        ledger.ledger.start()
+        self.monitor.start()
+        # the cache loads above are not per request work
+        self.startup_queries = self.queries.count
+
+    async def close(self):
+        from src import db, ledger, search, store
+
+        self.monitor.stop()
+        await ledger.ledger.close()
+        await db.pool.close()
+        await store.store.close()
+        await search.close()
+
+    def dispatch(self, event: str, *args):
+        """Runs the bot's handler for a gateway event in its own task, like discord.py does."""
+        handler = getattr(self.main, f"on_{event}", None)
+        if handler is not None:
+            self._spawn(handler(*args))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def user(self, name: str) -> FakeUser:
+        if name not in self._users:
+            self._users[name] = FakeUser(name)
+        return self._users[name]
+
+    def channel(self, guild_name: str) -> FakeTextChannel:
+        if guild_name not in self._channels:
+            from src.constants import ALLOWED_SERVER_IDS
+
+            guild = self._guilds[guild_name] = FakeGuild()
+            ALLOWED_SERVER_IDS.append(guild.id)
+            channel = FakeTextChannel(guild, "general", self.dispatch)
+            channel.bot_user = self.bot
+            self._channels[guild_name] = channel
+        return self._channels[guild_name]
+
+    def _new_thread(self, step: Step) -> FakeThread:
+        from src.constants import ACTIVATE_THREAD_PREFX
+
+        channel = self.channel(step.guild)
+        thread = FakeThread(
+            channel, f"{ACTIVATE_THREAD_PREFX} {step.user}", self.bot.id, self.dispatch
+        )
+        author = self.user(step.user)
+        for i in range(self.history):
+            speaker = author if i % 2 == 0 else self.bot
+            thread.messages.append(FakeMessage(thread, speaker, QUESTIONS[i % len(QUESTIONS)]))
+        return thread
+
+    async def thread(self, step: Step) -> FakeThread:
+        """The Discord thread for a trace thread, made on first use unless a /chat creates it."""
+        future = self._threads.get(step.thread)
+        if future is None:
+            future = self._threads[step.thread] = asyncio.get_running_loop().create_future()
+            future.set_result(self._new_thread(step))
+        return await future
+
+    async def perform(self, step: Step):
+        user = self.user(step.user)
+        if step.kind == "chat":
+            future = self._threads[step.thread] = asyncio.get_running_loop().create_future()
+            channel = self.channel(step.guild)
+            before = len(channel.threads)
+            start = time.perf_counter()
+            await self.main.thread_command.callback(FakeInteraction(channel, user))
+            self.command_latencies.append(time.perf_counter() - start)
+            if len(channel.threads) > before:
+                future.set_result(channel.threads[-1])
+            else:
+                # refused, e.g. the user hit the thread limit, chat in a plain thread instead
+                future.set_result(self._new_thread(step))
+            return
+        thread = await self.thread(step)
+        self.requests += 1
+        if step.kind == "google":
+            start = time.perf_counter()
+            await self.main.chat_command.callback(FakeInteraction(thread, user), step.text)
+            self.command_latencies.append(time.perf_counter() - start)
+        else:
+            thread.say(user, step.text)
+
+    async def run(self, steps: List[Step], speed: float = 1.0, drain_timeout: float = 300):
+        """Performs each step at its time (divided by speed), then waits for replies to finish."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for step in steps:
+            delay = start + step.at / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._spawn(self.perform(step))
+        await self.drain(drain_timeout)
+
+    async def drain(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while self._tasks or self.main.debouncer.pending:
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.05)
+
+    def threads(self, prefix: str = "") -> List[FakeThread]:
+        """Threads created so far, optionally only those whose trace name starts with prefix."""
+        return [
+            f.result()
+            for name, f in self._threads.items()
+            if name.startswith(prefix) and f.done()
+        ]
+
+    def message_latencies(self, prefix: str = ""):
+        """Time from each user message to the bot's reply, using the recorded thread events.
+
+        A message is answered by the bot text sent or edited before the next user
+        message in the thread; first is the first of those, complete the last.
+        Messages followed by another before any reply were coalesced by the debounce.
+        """
+        first, complete = [], []
+        coalesced = unanswered = 0
+        for thread in self.threads(prefix):
+            events = sorted(thread.events, key=lambda e: e.at)
+            asked = [i for i, e in enumerate(events) if e.kind == "user"]
+            for n, i in enumerate(asked):
+                end = asked[n + 1] if n + 1 < len(asked) else len(events)
+                replies = [e for e in events[i + 1 : end] if e.bot and e.message.content]
+                if replies:
+                    first.append(replies[0].at - events[i].at)
+                    complete.append(replies[-1].at - events[i].at)
+                elif n + 1 < len(asked):
+                    coalesced += 1
+                else:
+                    unanswered += 1
+        return first, complete, coalesced, unanswered
+
+    def report(self, upstream_stats: Dict[str, int], wall_seconds: float) -> dict:
+        from src import metrics
+        from src.completion import CompletionResult
+
+        first, complete, coalesced, unanswered = self.message_latencies()
+        requests = max(self.requests, 1)
+        return {
+            "wall_seconds": round(wall_seconds, 2),
+            "requests": self.requests,
+            "threads": len(self._threads),
+            "latency_first_reply_seconds": percentiles(first),
+            "latency_complete_reply_seconds": percentiles(complete),
+            "latency_command_seconds": percentiles(self.command_latencies),
+            "coalesced": coalesced,
+            "unanswered": unanswered,
+            "completions": {
+                r.name: metrics.completions.value(status=r.name) for r in CompletionResult
+            },
+            "openai_chat_calls_per_request": round(upstream_stats.get("chat", 0) / requests, 3),
+            "openai_moderation_calls_per_request": round(
+                upstream_stats.get("moderation", 0) / requests, 3
+            ),
+            "search_calls_per_request": round(upstream_stats.get("search", 0) / requests, 3),
+            "db_queries_per_request": round(
+                (self.queries.count - self.startup_queries) / requests, 3
+            ),
+            "upstream_calls": upstream_stats,
+            "event_loop": self.monitor.summary(),
+        }
@@ -0,0 +1,218 @@
+"""Open-loop load generator that ramps the message rate until latency SLOs break.
+
+    python -m bench.loadgen --threads 200 --guilds 5 --start-rate 0.5 --factor 1.5
+    python -m bench.loadgen --out runs/$(git rev-parse --short HEAD).json
+
+Each stage injects messages with Poisson arrivals at a fixed rate into fresh
+threads spread over the guilds, without waiting for replies. Some arrivals
+are bursts from the same user a moment apart, which go through the real
+debounce and stale-message checks. Threads start with --history messages
+so prompts are built from long histories, up to MAX_THREAD_MESSAGES.
+Between stages the harness drains. The report says which rate was the last
+to meet the SLOs (the knee), and how many threads were being served at once.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+from bench import upstream
+from bench.harness import QUESTIONS, Harness, Step, Upstream, percentiles
+
+
+@dataclass
+class Burst:
+    probability: float  # chance an arrival is followed by more messages from the same user
+    max_messages: int
+    max_gap: float  # seconds between messages of a burst
+
+
+def arrivals(
+    rate: float,
+    duration: float,
+    threads: int,
+    guilds: int,
+    burst: Burst,
+    rng: random.Random,
+    prefix: str,
+) -> List[Step]:
+    steps = []
+    at = rng.expovariate(rate)
+    while at < duration:
+        t = rng.randrange(threads)
+        thread, guild, user = f"{prefix}t{t}", f"g{t % guilds}", f"u{t}"
+        steps.append(Step(at=at, thread=thread, user=user, text=rng.choice(QUESTIONS), guild=guild))
+        if rng.random() < burst.probability:
+            follow = at
+            for _ in range(rng.randint(1, burst.max_messages)):
+                follow += rng.uniform(0.2, burst.max_gap)
+                steps.append(
+                    Step(at=follow, thread=thread, user=user, text=rng.choice(QUESTIONS), guild=guild)
+                )
+        at += rng.expovariate(rate)
+    return sorted(steps, key=lambda s: s.at)
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _completion_counts() -> Dict[str, float]:
+    from src import metrics
+    from src.completion import CompletionResult
+
+    return {r.name: metrics.completions.value(status=r.name) for r in CompletionResult}
+
+
+async def _sample_concurrency(harness: Harness, samples: List[int]):
+    while True:
+        samples.append(harness.main.debouncer.pending)
+        await asyncio.sleep(0.1)
+
+
+async def run_stage(
+    harness: Harness, stub: Upstream, args: argparse.Namespace, index: int, rate: float
+) -> dict:
+    rng = random.Random(args.seed + index)
+    burst = Burst(args.burst_probability, args.burst_max, args.burst_gap)
+    prefix = f"s{index}-"
+    steps = arrivals(rate, args.stage_seconds, args.threads, args.guilds, burst, rng, prefix)
+
+    calls_before = await stub.stats()
+    queries_before = harness.queries.count
+    lags_before = len(harness.monitor.lags)
+    completions_before = _completion_counts()
+    requests_before = harness.requests
+    concurrency: List[int] = []
+    sampler = asyncio.create_task(_sample_concurrency(harness, concurrency))
+    start = time.perf_counter()
+    try:
+        await harness.run(steps, drain_timeout=args.drain_timeout)
+    finally:
+        sampler.cancel()
+    wall = time.perf_counter() - start
+
+    calls_after = await stub.stats()
+    first, complete, coalesced, unanswered = harness.message_latencies(prefix)
+    completions = {
+        k: v - completions_before.get(k, 0) for k, v in _completion_counts().items()
+    }
+    requests = max(harness.requests - requests_before, 1)
+    # failed completions and messages left without any reply
+    errors = sum(completions.get(r, 0) for r in ("OTHER_ERROR", "INVALID_REQUEST", "UNAVAILABLE"))
+    error_rate = (errors + unanswered) / requests
+    lags = harness.monitor.lags[lags_before:]
+    latency = percentiles(complete)
+    passed = (
+        latency.get("p95", 0) <= args.slo_p95
+        and latency.get("p99", 0) <= args.slo_p99
+        and error_rate <= args.slo_error_rate
+    )
+    return {
+        "rate": round(rate, 4),
+        "messages": len(steps),
+        "message_rate": round(len(steps) / args.stage_seconds, 4),
+        "threads": len({s.thread for s in steps}),
+        "wall_seconds": round(wall, 2),
+        "latency_first_reply_seconds": percentiles(first),
+        "latency_complete_reply_seconds": latency,
+        "coalesced": coalesced,
+        "unanswered": unanswered,
+        "completions": completions,
+        "error_rate": round(error_rate, 4),
+        "concurrent_threads_peak": max(concurrency, default=0),
+        "concurrent_threads_mean": round(sum(concurrency) / len(concurrency), 2) if concurrency else 0,
+        "openai_chat_calls_per_request": round(
+            (calls_after.get("chat", 0) - calls_before.get("chat", 0)) / requests, 3
+        ),
+        "db_queries_per_request": round((harness.queries.count - queries_before) / requests, 3),
+        "event_loop_stalls": sum(lag > harness.monitor.stall_threshold for lag in lags),
+        "event_loop_lag_max_ms": round(max(lags, default=0) * 1000, 2),
+        "passed": passed,
+    }
+
+
+async def ramp(args: argparse.Namespace, stub: Upstream) -> dict:
+    harness = Harness(stub.url, history=args.history)
+    stages = []
+    try:
+        await harness.start()
+        rate, index = args.start_rate, 0
+        while rate <= args.max_rate:
+            stage = await run_stage(harness, stub, args, index, rate)
+            stages.append(stage)
+            print(
+                f"rate {stage['rate']}/s: p95 {stage['latency_complete_reply_seconds'].get('p95')}s "
+                f"peak threads {stage['concurrent_threads_peak']} "
+                f"{'ok' if stage['passed'] else 'SLO broken'}",
+                file=sys.stderr,
+            )
+            if not stage["passed"]:
+                break
+            rate, index = rate * args.factor, index + 1
+    finally:
+        await harness.close()
+
+    passing = [s for s in stages if s["passed"]]
+    knee = passing[-1] if passing else None
+    return {
+        "revision": _git_revision(),
+        "config": {k: str(v) if isinstance(v, upstream.Latency) else v for k, v in vars(args).items()},
+        "slo": {"p95": args.slo_p95, "p99": args.slo_p99, "error_rate": args.slo_error_rate},
+        "knee": {
+            "rate": knee["rate"],
+            "message_rate": knee["message_rate"],
+            "concurrent_threads_peak": knee["concurrent_threads_peak"],
+        }
+        if knee
+        else None,
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=100, help="threads per stage")
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--history", type=int, default=100, help="messages already in each thread")
+    parser.add_argument("--start-rate", type=float, default=0.5, help="arrivals per second in the first stage")
+    parser.add_argument("--factor", type=float, default=1.5, help="rate multiplier between stages")
+    parser.add_argument("--max-rate", type=float, default=50)
+    parser.add_argument("--stage-seconds", type=float, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--burst-probability", type=float, default=0.3)
+    parser.add_argument("--burst-max", type=int, default=3, help="most extra messages in a burst")
+    parser.add_argument("--burst-gap", type=float, default=2.0, help="most seconds between burst messages")
+    parser.add_argument("--slo-p95", type=float, default=10.0, help="seconds to the complete reply")
+    parser.add_argument("--slo-p99", type=float, default=20.0)
+    parser.add_argument("--slo-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the report to this file")
+    upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    stub = Upstream(upstream.config_from_args(args))
+    stub.start()
+    try:
+        report = asyncio.run(ramp(args, stub))
+    finally:
+        stub.stop()
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Replays a recorded or synthetic conversation trace through the bot offline.
+
+    python -m bench.replay --threads 20 --messages 5
+    python -m bench.replay --trace conversations.jsonl --speed 4 --out report.json
+
+Trace lines look like
+{"at": 1.5, "thread": "t1", "user": "alice", "text": "hi", "kind": "message"}
+where kind is message, google or chat.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bench import upstream
+from bench.harness import Harness, Upstream, load_trace, synthetic
+
+
+async def replay(args: argparse.Namespace) -> dict:
+    if args.trace:
+        steps = load_trace(args.trace)
+    else:
+        steps = synthetic(args.threads, args.messages, args.think, args.seed)
+    stub = Upstream(upstream.config_from_args(args))
+    stub.start()
+    harness = Harness(stub.url, history=args.history)
+    try:
+        await harness.start()
+        start = time.perf_counter()
+        await harness.run(steps, speed=args.speed)
+        wall = time.perf_counter() - start
+        stats = await stub.stats()
+    finally:
+        # closing flushes buffered cost rows, so the report counts their writes
+        await harness.close()
+        stub.stop()
+    return harness.report(stats, wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of a synthetic one")
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5, help="messages per synthetic thread")
+    parser.add_argument("--think", type=float, default=20, help="mean seconds between a user's messages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay the trace this many times faster")
+    parser.add_argument("--history", type=int, default=0, help="messages already in each thread")
+    parser.add_argument("--out", help="also write the report to this file")
+    upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(replay(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Local stand-in for the OpenAI, Custom Search and scraped page endpoints.
+
+Runs in its own process so its work does not show up as event loop stalls
+in the bot being measured. Every endpoint sleeps for a delay drawn from a
+configurable latency distribution before answering.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import web
+
+MODERATION_CATEGORIES = [
+    "harassment",
+    "harassment/threatening",
+    "hate",
+    "hate/threatening",
+    "self-harm",
+    "self-harm/instructions",
+    "self-harm/intent",
+    "sexual",
+    "sexual/minors",
+    "violence",
+    "violence/graphic",
+]
+
+WORDS = (
+    "the bot answers questions about the project and explains how each part "
+    "works together with examples so that new members can get started quickly"
+).split()
+
+
+@dataclass
+class Latency:
+    """Log-normal delay given by its median and sigma, sigma 0 is a fixed delay."""
+
+    median: float
+    sigma: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """Parses "median" or "median:sigma", in seconds."""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0))
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def __str__(self) -> str:
+        return f"{self.median}:{self.sigma}"
+
+
+@dataclass
+class UpstreamConfig:
+    chat: Latency
+    moderation: Latency
+    search: Latency
+    page: Latency
+    reply_words: int = 60
+    error_rate: float = 0.0  # fraction of chat calls answered with a 500
+
+
+def _words(n: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(n))
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def build_app(config: UpstreamConfig) -> web.Application:
+    calls: Counter = Counter()
+
+    async def chat(request: web.Request) -> web.StreamResponse:
+        calls["chat"] += 1
+        body = await request.json()
+        delay = config.chat.sample()
+        if random.random() < config.error_rate:
+            await asyncio.sleep(delay / 4)
+            calls["chat_errors"] += 1
+            return web.json_response(
+                {"error": {"message": "stub failure", "type": "server_error"}}, status=500
+            )
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body["messages"])
+        words = [random.choice(WORDS) for _ in range(config.reply_words)]
+        base = {
+            "id": f"chatcmpl-{calls['chat']}",
+            "created": int(time.time()),
+            "model": body["model"],
+        }
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": " ".join(words)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": _usage(prompt_tokens, len(words)),
+                }
+            )
+
+        # a fifth of the delay before the first token, the rest spread over the words
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(delay / 5)
+        per_word = delay * 4 / 5 / max(len(words), 1)
+
+        async def event(payload: dict):
+            await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+
+        for i, word in enumerate(words):
+            await event(
+                {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else " " + word},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+            )
+            await asyncio.sleep(per_word)
+        await event(
+            {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await event(
+                {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [],
+                    "usage": _usage(prompt_tokens, len(words)),
+                }
+            )
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def moderations(request: web.Request) -> web.Response:
+        calls["moderation"] += 1
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        calls["moderation_inputs"] += len(inputs)
+        await asyncio.sleep(config.moderation.sample())
+        result = {
+            "flagged": False,
+            "categories": {c: False for c in MODERATION_CATEGORIES},
+            "category_scores": {c: 0.0001 for c in MODERATION_CATEGORIES},
+        }
+        return web.json_response(
+            {"id": "modr-stub", "model": body.get("model"), "results": [result] * len(inputs)}
+        )
+
+    async def search(request: web.Request) -> web.Response:
+        calls["search"] += 1
+        await asyncio.sleep(config.search.sample())
+        q = request.query.get("q", "")
+        base = f"{request.scheme}://{request.host}"
+        items = [
+            {"title": f"Result {i}", "link": f"{base}/page/{i}?q={abs(hash(q)) % 1000}"}
+            for i in range(10)
+        ]
+        return web.json_response({"items": items})
+
+    async def page(request: web.Request) -> web.Response:
+        calls["page"] += 1
+        await asyncio.sleep(config.page.sample())
+        paragraphs = "".join(f"<p>{_words(80)}</p>" for _ in range(20))
+        html = (
+            "<html><head><title>stub</title><script>var x = 1;</script></head>"
+            f"<body><nav>menu</nav>{paragraphs}</body></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(calls))
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/v1/moderations", moderations)
+    app.router.add_get("/customsearch/v1", search)
+    app.router.add_get("/page/{n}", page)
+    app.router.add_get("/_stats", stats)
+    return app
+
+
+def serve(config: UpstreamConfig, port: int):
+    """Runs the stub until the process is terminated."""
+    web.run_app(build_app(config), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--chat-latency", type=Latency.parse, default=Latency(1.5, 0.5),
+                        help="median[:sigma] seconds for a chat completion")
+    parser.add_argument("--moderation-latency", type=Latency.parse, default=Latency(0.15, 0.3))
+    parser.add_argument("--search-latency", type=Latency.parse, default=Latency(0.3, 0.3))
+    parser.add_argument("--page-latency", type=Latency.parse, default=Latency(0.4, 0.6))
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of chat completions answered with a 500")
+
+
+def config_from_args(args: argparse.Namespace) -> UpstreamConfig:
+    return UpstreamConfig(
+        chat=args.chat_latency,
+        moderation=args.moderation_latency,
+        search=args.search_latency,
+        page=args.page_latency,
+        reply_words=args.reply_words,
+        error_rate=args.error_rate,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    serve(config_from_args(args), args.port)
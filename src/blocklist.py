@@ -0,0 +1,102 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Optional, Set
+
+from src import db, metrics
+from src.constants import BLOCKLIST_REFRESH_SECONDS
+from src.store import store
+from src.utils import logger
+
+CHANNEL = "blocklist"
+LOAD_RETRY_SECONDS = 10
+
+
+class BlockList:
+    """In-memory copy of the blocked rows of JaduBlockedUsers.
+
+    /deny and /allow write through to the table and the set, and publish the
+    change so other bot processes apply it too. A background task reloads the
+    table periodically to pick up edits made outside the bot.
+
+    Until the table has been read once everyone counts as blocked, callers
+    that would tell the user so should check loaded first. A failed reload
+    later on keeps the last good set.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._blocked: Set[str] = set()
+        self._writes = 0
+        self._loaded = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def is_blocked(self, user_id) -> bool:
+        with metrics.stage("blocklist_check"):
+            return not self._loaded or str(user_id) in self._blocked
+
+    async def load(self):
+        writes = self._writes
+        rows = await db.pool.fetchall(
+            "SELECT BlockedUserID FROM JaduBlockedUsers WHERE IsBlocked = 1"
+        )
+        if writes != self._writes:
+            # a /deny or /allow landed while we were reading, keep its result
+            return
+        self._blocked = {str(row[0]) for row in rows}
+        self._loaded = True
+        logger.info(f"Loaded {len(self._blocked)} blocked users")
+
+    async def block(self, user_id, moderator: str):
+        await db.pool.execute(
+            "INSERT INTO JaduBlockedUsers (Moderator, BlockedUserID, DateTime, IsBlocked) VALUES  (%s, %s,%s, %s)",
+            (str(moderator), str(user_id), str(datetime.now()), 1),
+        )
+        self._apply(user_id, True)
+        await store.publish(CHANNEL, json.dumps({"user_id": str(user_id), "blocked": True}))
+
+    async def allow(self, user_id):
+        await db.pool.execute(
+            "UPDATE JaduBlockedUsers SET IsBlocked = 0 WHERE BlockedUserID = %s",
+            (str(user_id),),
+        )
+        self._apply(user_id, False)
+        await store.publish(CHANNEL, json.dumps({"user_id": str(user_id), "blocked": False}))
+
+    def _apply(self, user_id, blocked: bool):
+        self._writes += 1
+        if blocked:
+            self._blocked.add(str(user_id))
+        else:
+            self._blocked.discard(str(user_id))
+
+    def _on_published(self, message: str):
+        change = json.loads(message)
+        self._apply(change["user_id"], change["blocked"])
+
+    async def _load_or_log(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.exception(e)
+        if not self._loaded:
+            logger.error(f"Blocklist not loaded, blocking everyone, retrying in {LOAD_RETRY_SECONDS}s")
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds if self._loaded else LOAD_RETRY_SECONDS)
+            await self._load_or_log()
+
+    async def start(self):
+        if self._refresh_task is not None:
+            return
+        store.subscribe(CHANNEL, self._on_published)
+        self._refresh_task = asyncio.create_task(self._refresh_forever())
+        await self._load_or_log()
+
+
+blocklist = BlockList(refresh_seconds=BLOCKLIST_REFRESH_SECONDS)
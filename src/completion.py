@@ -1,15 +1,13 @@
 from enum import Enum
 from dataclasses import dataclass
 import openai
-from openai import OpenAI
-
-client = OpenAI()
+from src import openai_client
 from src.moderation import moderate_message
-from typing import Optional, List
+from typing import Awaitable, Callable, Optional, List
+from src import constants
 from src.constants import (
-    BOT_INSTRUCTIONS,
-    BOT_NAME,
-    EXAMPLE_CONVOS,
+    GOOGLE_FETCH_DEADLINE_SECONDS,
+    GOOGLE_CONTEXT_TOKENS,
 )
 import discord
 from src.base import Message, Prompt, Conversation
@@ -18,55 +16,65 @@ from src.moderation import (
     send_moderation_flagged_message,
     send_moderation_blocked_message,
 )
-import tiktoken
 import os
 from dotenv import load_dotenv
 
-import MySQLdb
-from datetime import datetime
+from src.ledger import ledger
+from src.tokens import tokens
+from src.context import build_context
+from src.streaming import StreamingReply
+from src.ranking import select_chunks
+from src.costs import completion_cost
+from src.scheduler import scheduler
+from src.resilience import CircuitOpen
 
-import requests
-from bs4 import BeautifulSoup
-import time
-from requests.exceptions import Timeout
+from src import search, tracing
 
 import asyncio
 
 load_dotenv()
 
-encoding = tiktoken.encoding_for_model("gpt-4")
-
-def simple_token_counter(text):
-    token_count = 0
-    for word in text.split():
-        # Very simplified: count every character or punctuation as a separate token
-        token_count += len(word)
-    return token_count
-
-def limit_tokens(strings, max_tokens):
-    total_tokens = 0
-    limited_strings = []
-    for string in strings:
-        tokens_in_string = simple_token_counter(string)
-        if total_tokens + tokens_in_string > max_tokens:
-            break
-        total_tokens += tokens_in_string
-        limited_strings.append(string)
-    return limited_strings
-
-def limit_string_tokens(string, max_tokens):
-    if len(string) > max_tokens:
-        string = string[:max_tokens]
-    return string
-
-def num_tokens_from_string(string: str) -> int:
-    """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
-
-MY_BOT_NAME = BOT_NAME
-MY_BOT_EXAMPLE_CONVOS = EXAMPLE_CONVOS
+# set from the bot's Discord user in on_ready, config.yaml is used until then
+MY_BOT_NAME: Optional[str] = None
+MY_BOT_EXAMPLE_CONVOS: Optional[List[Conversation]] = None
+
+
+def build_prompt(messages: List[Message]) -> Prompt:
+    bot_name = MY_BOT_NAME or constants.BOT_NAME
+    return Prompt(
+        header=Message(
+            "System", f"Instructions for {bot_name}: {constants.BOT_INSTRUCTIONS}"
+        ),
+        examples=MY_BOT_EXAMPLE_CONVOS
+        if MY_BOT_EXAMPLE_CONVOS is not None
+        else constants.EXAMPLE_CONVOS,
+        convo=Conversation(messages + [Message(bot_name)]),
+    )
+
+def _unavailable_text(e: CircuitOpen) -> str:
+    return f"The AI service is having trouble right now, please try again in {max(e.retry_in, 5):.0f} seconds."
+
+
+def _charge_cancelled(user, gptmodel: str, prompt_tokens: int, admission, partial_reply: str):
+    """Records what a request cancelled by a newer message probably cost.
+
+    OpenAI bills a request once it has started, so without this a user could
+    stay under the spend-based downgrade by sending follow-ups quickly.
+    """
+    reply_tokens = tokens.count(partial_reply, gptmodel) if partial_reply else 0
+    scheduler.settle(admission, prompt_tokens + reply_tokens)
+    ledger.record(user, completion_cost(gptmodel, prompt_tokens, reply_tokens))
+
+
+def _settle_failed(admission, e: Exception, prompt_tokens: int):
+    """Gives back the token budget of a request that failed.
+
+    A request stopped by an open circuit or a full lane never reached OpenAI,
+    any other failure is counted at its prompt.
+    """
+    sent = not isinstance(e, (CircuitOpen, openai_client.ModelBusy))
+    scheduler.settle(admission, prompt_tokens if sent else 0)
+
 
 class CompletionResult(Enum):
     OK = 0
@@ -75,6 +83,7 @@ class CompletionResult(Enum):
     OTHER_ERROR = 3
     MODERATION_FLAGGED = 4
     MODERATION_BLOCKED = 5
+    UNAVAILABLE = 6  # circuit breaker open, status_text says when to retry
 
 
 @dataclass
@@ -82,18 +91,21 @@ class CompletionData:
     status: CompletionResult
     reply_text: Optional[str]
     status_text: Optional[str]
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # set when the reply was already streamed into the thread
+    sent_messages: Optional[List[discord.Message]] = None
 
+@tracing.traced("generate_summary")
 async def generate_summary(
-    messages: List[Message], user: str, gptmodel=str
+    messages: List[Message],
+    user: str,
+    gptmodel=str,
+    priority: bool = False,
+    on_queued: Optional[Callable[[int], Awaitable]] = None,
 ) -> CompletionData:
     try:
-        prompt = Prompt(
-            header=Message(
-                "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
-            ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(messages + [Message(MY_BOT_NAME)]),
-        )
+        prompt = build_prompt(messages)
         rendered = prompt.render()
         
         question = ''
@@ -104,110 +116,71 @@ async def generate_summary(
         message_objects.append(system_prompt)
                 
 
-        GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-        GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
-
-        API_KEY = GOOGLE_API_KEY
-        SEARCH_ENGINE_ID = GOOGLE_CSE_ID
-
-        query = question
-        page = 1
-        start = (page - 1) * 5 + 1
+        search_items = await search.google_search(question)
+        links = [item.get("link") for item in search_items if item.get("link")]
+        pages = await search.fetch_texts(links, GOOGLE_FETCH_DEADLINE_SECONDS)
 
-        url = f"https://www.googleapis.com/customsearch/v1?key={API_KEY}&cx={SEARCH_ENGINE_ID}&q={query}&start={start}"
-
-        data = requests.get(url).json()
-
-        search_items = data.get("items")
-
-        GPTGoogleCosts = []
-        textList = []
-        for i, search_item in enumerate(search_items, start=1):
-            
-            link = search_item.get("link")
-                    
-            url = link
-            start_time = time.time()
-            try:
-                response = requests.get(url, timeout=7)
-
-                if time.time() - start_time < 7:
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                    text = soup.get_text()
-                    text = text.replace("/n", "")
-                    text = text.replace("\n", "")
-                    text = text.replace("\\n", "")
-                    text = text.replace("//n", "")
-                    text = text.replace("//", "")
-                    text = text.replace("\t", "")
-                    text = text.replace("\t3", "")
-                    text = text.replace("\xa0", "")
-                    text = text.replace("  ", "")
-
-                    if gptmodel == 'gpt-3.5-turbo':
-                        cost = round(num_tokens_from_string(limit_string_tokens(text,1000)+str(question))*1.1)/1000*0.006
-                    else:
-                        cost = round(num_tokens_from_string(limit_string_tokens(text,1000)+str(question))*1.1)/1000*0.06
-                    GPTGoogleCosts.append(cost)
-                    textList.append(limit_string_tokens(text,1000))
-                else:
-                    print(f"Skipping {link} as it took too long to get the data")
-            except Timeout:
-                # Handle the timeout exception
-                print("The request timed out")
-                pass
-
-            except requests.exceptions.RequestException as e:
-                # This will catch any other exceptions like HTTPError, ConnectionError etc.
-                print(f"An error occurred: {e}")
-                pass
-
-        limited_strings = limit_tokens(textList, 1500)
-
-        for prompt in limited_strings:
-            message_objects.append({"role": 'system', "content": f'{prompt}'})
+        page_texts = [pages[link] for link in links if link in pages]
+        selected = await select_chunks(
+            question, page_texts, GOOGLE_CONTEXT_TOKENS, gptmodel
+        )
+        excerpts = [" … ".join(chunks) for chunks in selected if chunks]
+        for excerpt in excerpts:
+            message_objects.append({"role": 'system', "content": excerpt})
 
-        token_list = []
         for message in messages:
             if message.text[0:1] != '<@':
                 message_object = {"role": message.user, "content": str(message.text)}
                 message_objects.append(message_object)
         for obj in message_objects:
-            token_list.append(num_tokens_from_string(obj['content']))
             if obj['role'] == 'JaduGPT':
                 obj['role'] = 'assistant'
             elif obj['role'] == 'system':
                 obj['role'] = 'system'
             else:
                 obj['role'] = 'user'
+
+        pinned = [obj for obj in message_objects if obj['role'] == 'system']
+        turns = [obj for obj in message_objects if obj['role'] != 'system']
+        window = await build_context(pinned, turns, gptmodel)
         
-        response = client.chat.completions.create(model = gptmodel,
-        temperature=0,
-        messages=message_objects)
+        estimated_tokens = window.prompt_tokens + window.max_output_tokens
+        async with scheduler.admit(
+            gptmodel, user.id, estimated_tokens, priority=priority, on_queued=on_queued
+        ) as admission:
+            try:
+                response = await openai_client.chat_completion(
+                    gptmodel,
+                    window.messages,
+                    temperature=0,
+                    max_tokens=window.max_output_tokens,
+                )
+            except asyncio.CancelledError:
+                _charge_cancelled(user, gptmodel, window.prompt_tokens, admission, "")
+                raise
+            except Exception as e:
+                _settle_failed(admission, e, window.prompt_tokens)
+                raise
 
         reply = response.choices[0].message.content
 
-        costs = sum(GPTGoogleCosts)+0.015
-                
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
+        scheduler.settle(admission, response.usage.total_tokens)
+        tracing.annotate(
+            model=gptmodel,
+            pages=len(page_texts),
+            turn_tokens=window.tokens.per_message,
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens,
+        )
+        ledger.record(
+            user,
+            completion_cost(
+                gptmodel, response.usage.prompt_tokens, response.usage.completion_tokens
+            ),
         )
-
-        mycursor = connection.cursor()
-
-        sql = "INSERT INTO JaduGPT (User, UserID, Cost, Datetime) VALUES (%s, %s,%s, %s)"
-        val = (str(user),str(user.id), str(costs), str(datetime.now()))
-        mycursor.execute(sql, val)
-
-        connection.commit()
-        connection.close()
 
         if reply:
-            flagged_str, blocked_str = moderate_message(
+            flagged_str, blocked_str = await moderate_message(
                 message=(rendered + reply)[-500:], user=user
             )
             if len(blocked_str) > 0:
@@ -228,8 +201,8 @@ async def generate_summary(
             status=CompletionResult.OK, reply_text=reply, status_text=None
         )
 
-    except openai.InvalidRequestError as e:
-        if "This model's maximum context length" in e.user_message:
+    except openai.BadRequestError as e:
+        if e.code == "context_length_exceeded":
             return CompletionData(
                 status=CompletionResult.TOO_LONG, reply_text=None, status_text=e
             )
@@ -240,6 +213,13 @@ async def generate_summary(
                 reply_text=None,
                 status_text=e,
             )
+    except CircuitOpen as e:
+        logger.warning(e)
+        return CompletionData(
+            status=CompletionResult.UNAVAILABLE,
+            reply_text=None,
+            status_text=_unavailable_text(e),
+        )
     except Exception as e:
         logger.exception(e)
         return CompletionData(
@@ -248,69 +228,104 @@ async def generate_summary(
         )
 
 
+@tracing.traced("generate_completion")
 async def generate_completion_response(
-    messages: List[Message], user: str, gptmodel=str
+    messages: List[Message],
+    user: str,
+    gptmodel=str,
+    stream_to: Optional[discord.Thread] = None,
+    priority: bool = False,
+    on_queued: Optional[Callable[[int], Awaitable]] = None,
 ) -> CompletionData:
     try:
-        prompt = Prompt(
-            header=Message(
-                "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
-            ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(messages + [Message(MY_BOT_NAME)]),
-        )
+        prompt = build_prompt(messages)
         rendered = prompt.render()
         message_objects = []
         system_prompt = {"role": 'system', "content": 'You are JaduGPT, a model just like ChatGPT but exclusive for Jadu NFT holders. Jadu is a collection of NFTs including a Jetpack, Hoverboard and Avatars. This project were created as a grant program lead by Thegen and voted by Jadu Community. You do not have the ability to answer questions about real time or current Jadu project or app updates. When asked questions about future changes, current features, issues, bugs, or anything along these lines, direct the user to contact the Jadu moderator team, including Toven & BobTFD.'}
         message_objects.append(system_prompt)
-        token_list = []
         for message in messages:
             if message.text[0:2] != '<@':
                 message_object = {"role": message.user, "content": str(message.text)}
                 message_objects.append(message_object)
         for obj in message_objects:
-            token_list.append(num_tokens_from_string(obj['content']))
             if obj['role'] == 'JaduGPT':
                 obj['role'] = 'assistant'
             elif obj['role'] == 'system':
                 obj['role'] = 'system'
             else:
                 obj['role'] = 'user'
-        
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: client.chat.completions.create(model=gptmodel,
-        temperature=0,
-        messages=message_objects))
-        reply = response.choices[0].message.content
-        
-        token_list.append(num_tokens_from_string(reply))
-        
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
 
-        tokenSum = round(sum(token_list)*1.1)
-
-        if gptmodel == 'gpt-3.5-turbo':
-            cost = tokenSum/1000*0.006
+        # keep the system prompt and as many of the newest turns as fit
+        window = await build_context(message_objects[:1], message_objects[1:], gptmodel)
+        if window.dropped:
+            logger.info(f"Dropped {window.dropped} old turns to fit {gptmodel} context")
+
+        estimated_tokens = window.prompt_tokens + window.max_output_tokens
+        async with scheduler.admit(
+            gptmodel, user.id, estimated_tokens, priority=priority, on_queued=on_queued
+        ) as admission:
+            streamed = None
+            usage = None
+            try:
+                if stream_to is not None:
+                    streamed = StreamingReply(stream_to)
+                    try:
+                        async with openai_client.chat_completion_stream(
+                            gptmodel,
+                            window.messages,
+                            temperature=0,
+                            max_tokens=window.max_output_tokens,
+                            stream_options={"include_usage": True},
+                        ) as stream:
+                            async for chunk in stream:
+                                if chunk.usage:
+                                    usage = chunk.usage
+                                if chunk.choices and chunk.choices[0].delta.content:
+                                    await streamed.feed(chunk.choices[0].delta.content)
+                        reply = await streamed.finish()
+                    except BaseException:
+                        await streamed.discard()
+                        raise
+                else:
+                    response = await openai_client.chat_completion(
+                        gptmodel,
+                        window.messages,
+                        temperature=0,
+                        max_tokens=window.max_output_tokens,
+                    )
+                    reply = response.choices[0].message.content
+                    usage = response.usage
+            except asyncio.CancelledError:
+                # superseded by a newer message after the request went out
+                partial = streamed.text if streamed is not None else ""
+                _charge_cancelled(user, gptmodel, window.prompt_tokens, admission, partial)
+                raise
+            except Exception as e:
+                _settle_failed(admission, e, window.prompt_tokens)
+                raise
+        sent_messages = streamed.sent if streamed else None
+
+        if usage is not None:
+            prompt_tokens = usage.prompt_tokens
+            reply_tokens = usage.completion_tokens
         else:
-            cost = tokenSum/1000*0.06
-
-        sql = "INSERT INTO JaduGPT (User, UserID, Cost, Datetime) VALUES (%s, %s,%s, %s)"
-        val = (str(user),str(user.id), str(cost), str(datetime.now()))
-        mycursor.execute(sql, val)
-
-        connection.commit()
-        connection.close()
+            # the API did not report usage, fall back to our own count
+            prompt_tokens = window.prompt_tokens
+            [reply_tokens] = await tokens.count_many([reply or ""], gptmodel)
+
+        scheduler.settle(admission, prompt_tokens + reply_tokens)
+        tracing.annotate(
+            model=gptmodel,
+            streamed=streamed is not None,
+            dropped_turns=window.dropped,
+            turn_tokens=window.tokens.per_message,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=reply_tokens,
+        )
+        ledger.record(user, completion_cost(gptmodel, prompt_tokens, reply_tokens))
 
         if reply:
-            flagged_str, blocked_str = moderate_message(
+            flagged_str, blocked_str = await moderate_message(
                 message=(rendered + reply)[-500:], user=user
             )
             if len(blocked_str) > 0:
@@ -318,6 +333,9 @@ async def generate_completion_response(
                     status=CompletionResult.MODERATION_BLOCKED,
                     reply_text=reply,
                     status_text=f"from_response:{blocked_str}",
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=reply_tokens,
+                    sent_messages=sent_messages,
                 )
 
             if len(flagged_str) > 0:
@@ -325,13 +343,21 @@ async def generate_completion_response(
                     status=CompletionResult.MODERATION_FLAGGED,
                     reply_text=reply,
                     status_text=f"from_response:{flagged_str}",
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=reply_tokens,
+                    sent_messages=sent_messages,
                 )
 
         return CompletionData(
-            status=CompletionResult.OK, reply_text=reply, status_text=None
+            status=CompletionResult.OK,
+            reply_text=reply,
+            status_text=None,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=reply_tokens,
+            sent_messages=sent_messages,
         )
-    except openai.InvalidRequestError as e:
-        if "This model's maximum context length" in e.user_message:
+    except openai.BadRequestError as e:
+        if e.code == "context_length_exceeded":
             return CompletionData(
                 status=CompletionResult.TOO_LONG, reply_text=None, status_text="Failed to complete the chat, it seems text were too long. Please try again in a new chat. If the error continues reach out to moderators with specifications of when the error occured."
             )
@@ -342,6 +368,13 @@ async def generate_completion_response(
                 reply_text=None,
                 status_text='Oops, an error occured while processing your request. Please try again in a new chat, if error persist please reach out to moderators. You can add them to the Thread by mentioning them with @.',
             )
+    except CircuitOpen as e:
+        logger.warning(e)
+        return CompletionData(
+            status=CompletionResult.UNAVAILABLE,
+            reply_text=None,
+            status_text=_unavailable_text(e),
+        )
     except Exception as e:
         logger.exception(e)
         return CompletionData(
@@ -360,7 +393,10 @@ async def process_response(
     
     if status is CompletionResult.OK or status is CompletionResult.MODERATION_FLAGGED:
         sent_message = None
-        if not reply_text:
+        if response_data.sent_messages:
+            # already streamed into the thread
+            sent_message = response_data.sent_messages[-1]
+        elif not reply_text:
             sent_message = await thread.send(
                 embed=discord.Embed(
                     description=f"**Invalid response** - empty response",
@@ -387,6 +423,8 @@ async def process_response(
                 )
             )
     elif status is CompletionResult.MODERATION_BLOCKED:
+        for sent_message in response_data.sent_messages or []:
+            await sent_message.delete()
         await send_moderation_blocked_message(
             guild=thread.guild,
             user=user,
@@ -402,6 +440,13 @@ async def process_response(
         )
     elif status is CompletionResult.TOO_LONG:
         await close_thread(thread)
+    elif status is CompletionResult.UNAVAILABLE:
+        await thread.send(
+            embed=discord.Embed(
+                description=f"**Error** - {status_text}",
+                color=discord.Color.yellow(),
+            )
+        )
     elif status is CompletionResult.INVALID_REQUEST:
         await thread.send(
             embed=discord.Embed(
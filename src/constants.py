@@ -1,22 +1,40 @@
 from dotenv import load_dotenv
+import functools
 import os
-import dacite
-import yaml
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from src.base import Config
 
 load_dotenv()
 
 
-# load config.yaml
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-CONFIG: Config = dacite.from_dict(
-    Config, yaml.safe_load(open(os.path.join(SCRIPT_DIR, "config.yaml"), "r"))
-)
 
-BOT_NAME = CONFIG.name
-BOT_INSTRUCTIONS = CONFIG.instructions
-EXAMPLE_CONVOS = CONFIG.example_conversations
+
+@functools.lru_cache(maxsize=None)
+def load_config() -> Config:
+    """Parses config.yaml, once, the first time it is needed."""
+    import dacite
+    import yaml
+
+    with open(os.path.join(SCRIPT_DIR, "config.yaml"), "r") as f:
+        return dacite.from_dict(Config, yaml.safe_load(f))
+
+
+# CONFIG, BOT_NAME, BOT_INSTRUCTIONS and EXAMPLE_CONVOS come from config.yaml on first access
+_CONFIG_FIELDS = {
+    "BOT_NAME": "name",
+    "BOT_INSTRUCTIONS": "instructions",
+    "EXAMPLE_CONVOS": "example_conversations",
+}
+
+
+def __getattr__(name: str):
+    if name == "CONFIG":
+        return load_config()
+    if name in _CONFIG_FIELDS:
+        return getattr(load_config(), _CONFIG_FIELDS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 DISCORD_BOT_TOKEN = os.environ["DISCORD_BOT_TOKEN"]
 DISCORD_CLIENT_ID = os.environ["DISCORD_CLIENT_ID"]
@@ -67,3 +85,143 @@ INACTIVATE_THREAD_PREFIX = "💬❌"
 MAX_CHARS_PER_REPLY_MSG = (
     1500  # discord has a 2k limit, we just break message into 1.5k
 )
+
+# MySQL connection pool shared by every handler
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 5))
+DB_POOL_ACQUIRE_TIMEOUT = float(
+    os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 10)
+)  # seconds a handler waits for a free connection before giving up
+DB_POOL_HEALTH_CHECK_SECONDS = float(
+    os.environ.get("DB_POOL_HEALTH_CHECK_SECONDS", 60)
+)  # idle connections older than this are pinged before being handed out
+DB_CONNECT_TIMEOUT = int(
+    os.environ.get("DB_CONNECT_TIMEOUT", 10)
+)  # seconds a new connection may take, it holds a pool slot meanwhile
+
+BLOCKLIST_REFRESH_SECONDS = float(
+    os.environ.get("BLOCKLIST_REFRESH_SECONDS", 300)
+)  # reload JaduBlockedUsers in case it was edited outside of /deny and /allow
+
+SPEND_WINDOW_HOURS = 24  # per-user spend window used to pick the model
+SPEND_RECONCILE_SECONDS = float(
+    os.environ.get("SPEND_RECONCILE_SECONDS", 600)
+)  # how often the in-memory spend is rebuilt from JaduGPT
+
+# write-behind buffer for the JaduGPT cost ledger
+LEDGER_BATCH_SIZE = int(os.environ.get("LEDGER_BATCH_SIZE", 20))
+LEDGER_FLUSH_SECONDS = float(os.environ.get("LEDGER_FLUSH_SECONDS", 5))
+LEDGER_MAX_BUFFERED_ROWS = 10000  # oldest rows are dropped past this if MySQL stays down
+
+# in-memory per-thread conversation cache
+HISTORY_CACHE_MAX_THREADS = int(os.environ.get("HISTORY_CACHE_MAX_THREADS", 500))
+HISTORY_CACHE_MAX_CHARS = int(
+    os.environ.get("HISTORY_CACHE_MAX_CHARS", 20_000_000)
+)  # total message text held across all cached threads
+HISTORY_CACHE_IDLE_SECONDS = float(
+    os.environ.get("HISTORY_CACHE_IDLE_SECONDS", 3600)
+)  # threads untouched for this long are evicted
+
+TOKEN_COUNT_CACHE_SIZE = int(
+    os.environ.get("TOKEN_COUNT_CACHE_SIZE", 50_000)
+)  # memoized per-message token counts
+TIKTOKEN_CACHE_DIR = os.environ.get(
+    "TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(SCRIPT_DIR), ".cache", "tiktoken")
+)  # encoding files, fill it with python -m src.tokens so startup needs no download
+
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(
+    os.environ.get("STREAM_EDIT_INTERVAL_SECONDS", 1.5)
+)  # discord allows ~5 message edits per 5s per channel, leave room for other sends
+
+# concurrent OpenAI requests allowed per model, and how many more may wait for a slot
+OPENAI_MAX_CONCURRENCY: Dict[str, int] = {
+    "gpt-3.5-turbo": 16,
+    "gpt-4-turbo-preview": 8,
+    "text-moderation-latest": 16,
+}
+OPENAI_DEFAULT_MAX_CONCURRENCY = 8
+OPENAI_MAX_QUEUED = int(os.environ.get("OPENAI_MAX_QUEUED", 50))
+MODERATION_MODEL = "text-moderation-latest"
+
+MODERATION_BATCH_WINDOW_SECONDS = 0.02  # collect moderation inputs this long before sending
+MODERATION_MAX_BATCH = 32  # inputs per moderation request
+MODERATION_CACHE_SIZE = 10000  # cached moderation scores, keyed by normalized text
+MODERATION_CACHE_TTL_SECONDS = 3600
+
+# /google search and page fetching
+GOOGLE_CSE_URL = os.environ.get(
+    "GOOGLE_CSE_URL", "https://www.googleapis.com/customsearch/v1"
+)
+GOOGLE_FETCH_DEADLINE_SECONDS = float(
+    os.environ.get("GOOGLE_FETCH_DEADLINE_SECONDS", 7)
+)  # one deadline for fetching all result pages, late pages are dropped
+GOOGLE_FETCH_MAX_CONNECTIONS = 20
+GOOGLE_FETCH_MAX_PER_HOST = 2
+GOOGLE_FETCH_MAX_BYTES = 2_000_000  # pages are truncated past this size
+GOOGLE_QUERY_CACHE_SIZE = 500
+GOOGLE_QUERY_CACHE_TTL_SECONDS = float(
+    os.environ.get("GOOGLE_QUERY_CACHE_TTL_SECONDS", 900)
+)  # repeat searches inside this window reuse the Custom Search results
+PAGE_CACHE_SIZE = 2000
+PAGE_CACHE_TTL_SECONDS = float(
+    os.environ.get("PAGE_CACHE_TTL_SECONDS", 3600)
+)  # older pages are revalidated with ETag/Last-Modified before reuse
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR")  # set to keep page text on disk
+PAGE_CACHE_MAX_FILES = 10000
+PAGE_TEXT_MAX_CHARS = 20000  # text kept per scraped page, ranked down to GOOGLE_CONTEXT_TOKENS
+GOOGLE_CONTEXT_TOKENS = 1500  # token budget for page excerpts in a /google prompt
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 2))  # processes parsing scraped html
+
+# USD per 1K (input, output) tokens, override with MODEL_PRICES=model:input:output,...
+MODEL_PRICES: Dict[str, Tuple[str, str]] = {
+    "gpt-3.5-turbo": ("0.0005", "0.0015"),
+    "gpt-4-turbo-preview": ("0.01", "0.03"),
+    "gpt-4": ("0.03", "0.06"),
+}
+for s in filter(None, os.environ.get("MODEL_PRICES", "").split(",")):
+    values = s.split(":")
+    MODEL_PRICES[values[0]] = (values[1], values[2])
+
+# OpenAI (requests per minute, tokens per minute) per model for our account tier,
+# override with OPENAI_RATE_LIMITS=model:rpm:tpm,...
+OPENAI_RATE_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gpt-3.5-turbo": (3500, 160000),
+    "gpt-4-turbo-preview": (500, 300000),
+    "gpt-4": (500, 10000),
+}
+OPENAI_DEFAULT_RATE_LIMIT = (500, 30000)
+for s in filter(None, os.environ.get("OPENAI_RATE_LIMITS", "").split(",")):
+    values = s.split(":")
+    OPENAI_RATE_LIMITS[values[0]] = (int(values[1]), int(values[2]))
+
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", 3))  # tries per OpenAI/Custom Search call
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = float(
+    os.environ.get("RETRY_MAX_DELAY_SECONDS", 8)
+)  # longer Retry-After values fail the request instead of holding the user
+BREAKER_FAILURE_THRESHOLD = int(
+    os.environ.get("BREAKER_FAILURE_THRESHOLD", 5)
+)  # consecutive failures before an endpoint is cut off
+BREAKER_RESET_SECONDS = float(
+    os.environ.get("BREAKER_RESET_SECONDS", 30)
+)  # how long a cut off endpoint fails fast before a probe is let through
+
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))  # 0 turns the /metrics endpoint off
+
+TRACE_FILE = os.environ.get("TRACE_FILE")  # set to write request spans there as JSON lines
+TRACE_SAMPLE_RATE = float(
+    os.environ.get("TRACE_SAMPLE_RATE", 1.0)
+)  # fraction of messages and commands whose trace is written
+
+# state shared between bot processes, e.g. redis://localhost:6379/0, unset keeps it in-process
+STORE_URL = os.environ.get("STORE_URL")
+THREAD_LIMIT = 2  # /chat threads a user may start per window, unless a moderator used /allow
+THREAD_LIMIT_WINDOW_SECONDS = 600
+
+# gateway sharding: SHARD_COUNT=auto uses Discord's recommended count, unset runs one plain client
+SHARD_COUNT = os.environ.get("SHARD_COUNT")
+SHARD_IDS = [
+    int(s) for s in filter(None, os.environ.get("SHARD_IDS", "").split(","))
+] or None  # shards run by this process, the launcher sets it for each process
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+from src.tokens import tokens, TurnTokens
+
+# per-message framing overhead of the chat format, see OpenAI's token counting guide
+TOKENS_PER_MESSAGE = 3
+REPLY_PRIMING_TOKENS = 3
+# a turn is only truncated to fit if at least this much of it survives
+MIN_TRUNCATED_TOKENS = 64
+TRUNCATION_MARKER = "…"
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    context_window: int
+    max_output_tokens: int
+
+
+MODEL_LIMITS: Dict[str, ModelLimits] = {
+    "gpt-3.5-turbo": ModelLimits(context_window=16385, max_output_tokens=4096),
+    "gpt-4-turbo-preview": ModelLimits(context_window=128000, max_output_tokens=4096),
+    "gpt-4": ModelLimits(context_window=8192, max_output_tokens=2048),
+}
+DEFAULT_LIMITS = MODEL_LIMITS["gpt-3.5-turbo"]
+
+
+def limits_for(model: str) -> ModelLimits:
+    return MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+
+
+@dataclass
+class ContextWindow:
+    messages: List[dict]
+    tokens: TurnTokens  # content tokens of the messages actually sent
+    prompt_tokens: int  # including chat framing overhead
+    dropped: int  # turns left out, a truncated turn is not counted
+    max_output_tokens: int
+
+
+async def build_context(pinned: List[dict], turns: List[dict], model: str) -> ContextWindow:
+    """Fits a request into the model's context window.
+
+    The pinned messages (system prompts) are always sent. Turns are added
+    newest first until the budget runs out, and the oldest turn that only
+    partly fits keeps its most recent tokens.
+    """
+    limits = limits_for(model)
+    budget = limits.context_window - limits.max_output_tokens - REPLY_PRIMING_TOKENS
+    counts = await tokens.count_many(
+        [str(m["content"]) for m in pinned + turns], model
+    )
+    pinned_counts, turn_counts = counts[: len(pinned)], counts[len(pinned) :]
+
+    used = sum(pinned_counts) + TOKENS_PER_MESSAGE * len(pinned)
+    kept: List[dict] = []
+    kept_counts: List[int] = []
+    for turn, count in zip(reversed(turns), reversed(turn_counts)):
+        if used + count + TOKENS_PER_MESSAGE <= budget:
+            kept.append(turn)
+            kept_counts.append(count)
+            used += count + TOKENS_PER_MESSAGE
+            continue
+        remaining = budget - used - TOKENS_PER_MESSAGE - 1
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            encoding = tokens.encoding(model)
+            encoded = encoding.encode(str(turn["content"]), disallowed_special=())
+            text = TRUNCATION_MARKER + encoding.decode(encoded[-remaining:])
+            count = tokens.count(text, model)
+            kept.append({**turn, "content": text})
+            kept_counts.append(count)
+            used += count + TOKENS_PER_MESSAGE
+        break
+
+    dropped = len(turns) - len(kept)
+    kept.reverse()
+    kept_counts.reverse()
+    per_message = pinned_counts + kept_counts
+    return ContextWindow(
+        messages=pinned + kept,
+        tokens=TurnTokens(per_message=per_message, total=sum(per_message)),
+        prompt_tokens=used + REPLY_PRIMING_TOKENS,
+        dropped=dropped,
+        max_output_tokens=limits.max_output_tokens,
+    )
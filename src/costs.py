@@ -0,0 +1,43 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional
+
+from src.constants import MODEL_PRICES
+from src.utils import logger
+
+COST_PLACES = Decimal("0.000001")
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    input_per_1k: Decimal
+    output_per_1k: Decimal
+
+
+PRICES: Dict[str, ModelPrice] = {
+    model: ModelPrice(Decimal(input_price), Decimal(output_price))
+    for model, (input_price, output_price) in MODEL_PRICES.items()
+}
+
+
+def price_for(model: str) -> Optional[ModelPrice]:
+    price = PRICES.get(model)
+    if price is None:
+        # dated snapshots like gpt-4-0613 are priced like their base model
+        for name in sorted(PRICES, key=len, reverse=True):
+            if model.startswith(name):
+                price = PRICES[name]
+                break
+    return price
+
+
+def completion_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Decimal:
+    price = price_for(model)
+    if price is None:
+        logger.error(f"No price configured for {model}, recording zero cost")
+        return Decimal(0)
+    cost = (
+        Decimal(prompt_tokens) * price.input_per_1k
+        + Decimal(completion_tokens) * price.output_per_1k
+    ) / 1000
+    return cost.quantize(COST_PLACES)
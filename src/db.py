@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Deque, Optional, Sequence, Tuple
+
+from src.constants import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_SECONDS,
+    DB_CONNECT_TIMEOUT,
+)
+from src import metrics
+from src.utils import logger
+
+
+def connect():
+    # imported here so a pool with another connect factory does not need mysqlclient
+    import MySQLdb
+
+    return MySQLdb.connect(
+        host=os.getenv("HOST"),
+        user=os.getenv("USERNAME2"),
+        password=os.getenv("PASSWORD"),
+        db=os.getenv("DATABASE"),
+        ssl=os.getenv("SSL_CERT"),
+        connect_timeout=DB_CONNECT_TIMEOUT,
+    )
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+@dataclass
+class PoolMetrics:
+    size: int = 0
+    in_use: int = 0
+    waiting: int = 0
+    acquired: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    connect_errors: int = 0
+    acquire_timeouts: int = 0
+    health_check_failures: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+class ConnectionPool:
+    """Process-wide pool of MySQL connections.
+
+    MySQLdb is blocking, so every query runs on a small dedicated thread pool
+    (one thread per connection) and handlers only ever await it.
+    """
+
+    def __init__(
+        self,
+        minsize: int,
+        maxsize: int,
+        acquire_timeout: float,
+        health_check_seconds: float,
+        connect: Callable[[], Any] = connect,
+    ):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.health_check_seconds = health_check_seconds
+        self.metrics = PoolMetrics()
+        self._connect = connect
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.maxsize, thread_name_prefix="db"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _new_connection(self):
+        try:
+            connection = await self._run(self._connect)
+        except Exception:
+            self.metrics.connect_errors += 1
+            raise
+        self.metrics.size += 1
+        return connection
+
+    async def _discard(self, connection):
+        self.metrics.size -= 1
+        try:
+            await self._run(connection.close)
+        except Exception:
+            pass
+
+    async def _checkout(self):
+        while self._idle:
+            connection, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.health_check_seconds:
+                return connection
+            try:
+                await self._run(connection.ping)
+                return connection
+            except Exception as e:
+                self.metrics.health_check_failures += 1
+                logger.info(f"Dropping stale db connection: {e}")
+                await self._discard(connection)
+        return await self._new_connection()
+
+    async def start(self):
+        """Opens the minimum number of connections up front."""
+        missing = self.minsize - self.metrics.size
+        if missing <= 0:
+            return
+        results = await asyncio.gather(
+            *[self._new_connection() for _ in range(missing)], return_exceptions=True
+        )
+        for r in results:
+            if isinstance(r, Exception):
+                logger.exception(r)
+            else:
+                self._idle.append((r, time.monotonic()))
+
+    async def close(self):
+        while self._idle:
+            connection, _ = self._idle.pop()
+            await self._discard(connection)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.maxsize)
+        start = time.monotonic()
+        self.metrics.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.acquire_timeouts += 1
+            raise PoolTimeout(
+                f"No db connection available after {self.acquire_timeout}s"
+            )
+        finally:
+            self.metrics.waiting -= 1
+        waited = time.monotonic() - start
+        self.metrics.acquired += 1
+        self.metrics.total_wait_seconds += waited
+        self.metrics.max_wait_seconds = max(self.metrics.max_wait_seconds, waited)
+
+        try:
+            connection = await self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        self.metrics.in_use += 1
+        healthy = False
+        try:
+            yield connection
+            healthy = True
+        finally:
+            self.metrics.in_use -= 1
+            if healthy:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                # the connection may be half way through a transaction or dead
+                await self._discard(connection)
+            self._slots.release()
+
+    async def fetchall(self, sql: str, args: Optional[Sequence] = None) -> Tuple:
+        def run(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql, args)
+                result = cursor.fetchall()
+                connection.commit()
+                return result
+            finally:
+                cursor.close()
+
+        with metrics.stage("db_read"):
+            async with self.acquire() as connection:
+                return await self._run(run, connection)
+
+    async def execute(self, sql: str, args: Optional[Sequence] = None) -> int:
+        def run(connection):
+            cursor = connection.cursor()
+            try:
+                rowcount = cursor.execute(sql, args)
+                connection.commit()
+                return rowcount
+            finally:
+                cursor.close()
+
+        with metrics.stage("db_write"):
+            async with self.acquire() as connection:
+                return await self._run(run, connection)
+
+    async def executemany(self, sql: str, rows: Sequence[Sequence]) -> int:
+        def run(connection):
+            cursor = connection.cursor()
+            try:
+                rowcount = cursor.executemany(sql, rows)
+                connection.commit()
+                return rowcount
+            finally:
+                cursor.close()
+
+        with metrics.stage("db_write"):
+            async with self.acquire() as connection:
+                return await self._run(run, connection)
+
+
+pool = ConnectionPool(
+    minsize=DB_POOL_MIN_SIZE,
+    maxsize=DB_POOL_MAX_SIZE,
+    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+    health_check_seconds=DB_POOL_HEALTH_CHECK_SECONDS,
+)
+
+metrics.Gauge(
+    "jadugpt_db_pool_connections",
+    "Database pool connections by state",
+    ["state"],
+    fn=lambda: {
+        ("open",): pool.metrics.size,
+        ("in_use",): pool.metrics.in_use,
+        ("waiting",): pool.metrics.waiting,
+    },
+)
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+from src import metrics
+from src.utils import logger
+
+
+class ThreadDebouncer:
+    """Runs at most one reply job per thread, for the newest message.
+
+    Submitting a job for a thread cancels the thread's previous job, whether
+    it is still waiting out the delay or already waiting on OpenAI, so a
+    burst of messages produces one completion for the last of them. A
+    completion cancelled after its request went out is still charged, see
+    completion._charge_cancelled.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._jobs: Dict[int, asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def submit(self, thread_id: int, job: Callable[[], Awaitable]) -> asyncio.Task:
+        previous = self._jobs.get(thread_id)
+        if previous is not None and not previous.done():
+            previous.cancel()
+        task = asyncio.create_task(self._run(job))
+        self._jobs[thread_id] = task
+        task.add_done_callback(lambda t: self._finished(thread_id, t))
+        return task
+
+    async def _run(self, job: Callable[[], Awaitable]):
+        if self.delay > 0:
+            with metrics.stage("debounce_wait"):
+                await asyncio.sleep(self.delay)
+        await job()
+
+    def _finished(self, thread_id: int, task: asyncio.Task):
+        if self._jobs.get(thread_id) is task:
+            del self._jobs[thread_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.exception(task.exception())
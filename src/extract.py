@@ -0,0 +1,66 @@
+"""HTML to plain text for scraped pages.
+
+Kept free of project imports, extraction needs nothing else. Workers still
+run the bot's entry module when they start, see search._extract_pool_or_create.
+"""
+from html.parser import HTMLParser
+from typing import List, Optional
+
+# content inside these tags is never useful as page text. head is not one of
+# them because </head> may be omitted, its text-bearing children are listed instead
+SKIPPED_TAGS = {"script", "style", "nav", "noscript", "template", "svg", "title", "iframe"}
+# void elements never get an end tag, so they must not open a skipped region
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+
+class _Enough(Exception):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.words: List[str] = []
+        self.chars = 0
+        self._skipping: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS and tag not in VOID_TAGS:
+            self._skipping.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._skipping:
+            # pop back to the matching tag, tolerating unclosed children
+            while self._skipping and self._skipping.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        if self._skipping:
+            return
+        for word in data.split():
+            self.words.append(word)
+            self.chars += len(word) + 1
+            if self.chars >= self.max_chars:
+                raise _Enough()
+
+
+def extract_text(html: bytes, max_chars: int, encoding: Optional[str] = None) -> str:
+    """Visible text of a page with whitespace collapsed, up to max_chars.
+
+    Parsing stops as soon as enough text has been collected.
+    """
+    try:
+        document = html.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        document = html.decode("utf-8", errors="replace")
+    parser = _TextExtractor(max_chars)
+    try:
+        parser.feed(document)
+        parser.close()
+    except _Enough:
+        pass
+    return " ".join(parser.words)[:max_chars]
@@ -1,22 +1,15 @@
 import requests
 import os
-from bs4 import BeautifulSoup
-import tiktoken
 from dotenv import load_dotenv
 import time
 from datetime import datetime
 from openai import OpenAI
+from src.tokens import tokens
+from src.extract import extract_text
 
 client = OpenAI()
 load_dotenv()
 
-encoding = tiktoken.encoding_for_model("gpt-4")
-
-def num_tokens_from_string(string: str) -> int:
-    """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
 
 def getGPTAnswer(systemPrompts:list, question:str):
         message_objects = []
@@ -63,19 +56,9 @@ def make_google_search(question:str):
         response = requests.get(url, timeout=5)
 
         if time.time() - start_time < 5:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            text = soup.get_text()
-            text = text.replace("/n", "")
-            text = text.replace("\n", "")
-            text = text.replace("\\n", "")
-            text = text.replace("//n", "")
-            text = text.replace("//", "")
-            text = text.replace("\t", "")
-            text = text.replace("\t3", "")
-            text = text.replace("\xa0", "")
-            text = text.replace("  ", "")
-
-            cost = round(num_tokens_from_string(text+str(question))*1.1)/1000*0.06
+            text = extract_text(response.content, 4000, response.encoding)
+
+            cost = round(tokens.count(text+str(question))*1.1)/1000*0.06
             GPTGoogleCosts.append(cost)
             textList.append(text[:4000])
         else:
@@ -84,8 +67,10 @@ def make_google_search(question:str):
     answer = getGPTAnswer(textList, question)
     costs = sum(GPTGoogleCosts)
     return {'answer':answer,'costs':costs}
-    
-question = 'What is the Jadu NFT and who is the CEO?'
-result = make_google_search(question)
 
-print(result)
\ No newline at end of file
+
+if __name__ == "__main__":
+    question = 'What is the Jadu NFT and who is the CEO?'
+    result = make_google_search(question)
+
+    print(result)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import discord
+from discord import Message as DiscordMessage
+
+from src import metrics
+from src.base import Message
+from src.constants import (
+    MAX_THREAD_MESSAGES,
+    HISTORY_CACHE_MAX_THREADS,
+    HISTORY_CACHE_MAX_CHARS,
+    HISTORY_CACHE_IDLE_SECONDS,
+)
+from src.utils import discord_message_to_message
+
+
+def _size(message: Message) -> int:
+    return len(message.text or "")
+
+
+class _ThreadHistory:
+    def __init__(self):
+        # keyed by message id; snowflakes sort chronologically
+        self.messages: Dict[int, Message] = {}
+        self.chars = 0
+        self.last_used = time.monotonic()
+        self.last_id: Optional[int] = None
+        self.loaded = False
+        self.stale = False
+        self.lock = asyncio.Lock()
+
+
+class ThreadHistoryStore:
+    """Per-thread conversation cache kept current from gateway events.
+
+    A thread is downloaded once the first time it is needed, then on_message,
+    edit and delete events keep it up to date. After a gateway reconnect the
+    cached threads only fetch what arrived after the last message they saw.
+    """
+
+    def __init__(self, max_threads: int, max_chars: int, idle_seconds: float):
+        self.max_threads = max_threads
+        self.max_chars = max_chars
+        self.idle_seconds = idle_seconds
+        self._threads: "OrderedDict[int, _ThreadHistory]" = OrderedDict()
+        self._chars = 0
+
+    def _put(self, entry: _ThreadHistory, message_id: int, message: Optional[Message]):
+        old = entry.messages.pop(message_id, None)
+        if old is not None:
+            entry.chars -= _size(old)
+            self._chars -= _size(old)
+        if message is None:
+            return
+        entry.messages[message_id] = message
+        entry.chars += _size(message)
+        self._chars += _size(message)
+        if entry.last_id is None or message_id > entry.last_id:
+            entry.last_id = message_id
+        if len(entry.messages) > MAX_THREAD_MESSAGES:
+            for oldest in sorted(entry.messages)[: len(entry.messages) - MAX_THREAD_MESSAGES]:
+                self._put(entry, oldest, None)
+
+    def _evict(self, keep: Optional[int] = None):
+        now = time.monotonic()
+        for thread_id in list(self._threads):
+            if thread_id == keep:
+                continue
+            entry = self._threads[thread_id]
+            over_limit = (
+                len(self._threads) > self.max_threads or self._chars > self.max_chars
+            )
+            if not over_limit and now - entry.last_used < self.idle_seconds:
+                # entries are in LRU order, everything after this is newer
+                break
+            self.forget(thread_id)
+
+    def forget(self, thread_id: int):
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._chars -= entry.chars
+
+    def invalidate(self):
+        """Marks every thread as possibly missing events, e.g. after a reconnect."""
+        for entry in self._threads.values():
+            entry.stale = True
+
+    def observe(self, message: DiscordMessage):
+        entry = self._threads.get(message.channel.id)
+        if entry is not None:
+            self._put(entry, message.id, discord_message_to_message(message))
+
+    def edit(self, channel_id: int, message_id: int, content: Optional[str]):
+        entry = self._threads.get(channel_id)
+        if entry is None or content is None:
+            return
+        old = entry.messages.get(message_id)
+        if old is not None:
+            self._put(entry, message_id, Message(user=old.user, text=content) if content else None)
+
+    def delete(self, channel_id: int, message_id: int):
+        entry = self._threads.get(channel_id)
+        if entry is not None:
+            self._put(entry, message_id, None)
+
+    async def _fill(self, thread: discord.Thread, entry: _ThreadHistory):
+        if not entry.loaded:
+            history = thread.history(limit=MAX_THREAD_MESSAGES)
+        else:
+            history = thread.history(
+                limit=MAX_THREAD_MESSAGES, after=discord.Object(id=entry.last_id or 0)
+            )
+        async for message in history:
+            if message.id not in entry.messages:
+                self._put(entry, message.id, discord_message_to_message(message))
+        entry.loaded = True
+        entry.stale = False
+
+    async def get(self, thread: discord.Thread) -> List[Message]:
+        """Returns the thread's messages, oldest first."""
+        entry = self._threads.get(thread.id)
+        if entry is None:
+            entry = self._threads[thread.id] = _ThreadHistory()
+        self._threads.move_to_end(thread.id)
+        entry.last_used = time.monotonic()
+        async with entry.lock:
+            if not entry.loaded or entry.stale:
+                try:
+                    with metrics.stage("history_fetch"):
+                        await self._fill(thread, entry)
+                except Exception:
+                    if not entry.loaded:
+                        self.forget(thread.id)
+                    raise
+        self._evict(keep=thread.id)
+        return [entry.messages[i] for i in sorted(entry.messages)]
+
+
+history = ThreadHistoryStore(
+    max_threads=HISTORY_CACHE_MAX_THREADS,
+    max_chars=HISTORY_CACHE_MAX_CHARS,
+    idle_seconds=HISTORY_CACHE_IDLE_SECONDS,
+)
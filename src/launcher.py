@@ -0,0 +1,104 @@
+"""Runs the bot as several processes, each connecting a group of shards.
+
+    SHARD_COUNT=8 STORE_URL=redis://localhost:6379/0 python -m src.launcher --processes 4
+
+With SHARD_COUNT unset or auto the count Discord recommends is used. Processes
+that exit with an error are restarted. Set STORE_URL so the processes share
+the blocklist, spend and thread limits, otherwise each one keeps its own.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List
+
+from src.constants import DISCORD_BOT_TOKEN, METRICS_PORT, SHARD_COUNT, STORE_URL
+from src.utils import logger
+
+RESTART_DELAY_SECONDS = 5
+STOP_TIMEOUT_SECONDS = 30  # children get this long to flush their cost rows before being killed
+
+
+def recommended_shards() -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {DISCORD_BOT_TOKEN}", "User-Agent": "JaduGPT"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)["shards"])
+
+
+def shard_groups(shard_count: int, processes: int) -> List[List[int]]:
+    processes = max(1, min(processes, shard_count))
+    return [list(range(i, shard_count, processes)) for i in range(processes)]
+
+
+def _spawn(index: int, shard_count: int, shard_ids: List[int]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = ",".join(map(str, shard_ids))
+    if METRICS_PORT:
+        # each process serves its own /metrics
+        env["METRICS_PORT"] = str(METRICS_PORT + index)
+    logger.info(f"Starting process {index} with shards {shard_ids}")
+    return subprocess.Popen([sys.executable, "-m", "src.main"], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
+    )
+
+    if SHARD_COUNT and SHARD_COUNT != "auto":
+        shard_count = int(SHARD_COUNT)
+    else:
+        shard_count = recommended_shards()
+    groups = shard_groups(shard_count, args.processes)
+    if len(groups) > 1 and not STORE_URL:
+        logger.warning("STORE_URL is not set, limits and spend will not be shared between processes")
+
+    stopping_since = None
+
+    def stop(signum, frame):
+        nonlocal stopping_since
+        if stopping_since is not None:
+            return
+        stopping_since = time.monotonic()
+        # each bot closes its gateway and writes out buffered cost rows on SIGTERM
+        for process in children.values():
+            process.terminate()
+
+    children: Dict[int, subprocess.Popen] = {
+        i: _spawn(i, shard_count, group) for i, group in enumerate(groups)
+    }
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        time.sleep(1)
+        if stopping_since is not None and time.monotonic() - stopping_since > STOP_TIMEOUT_SECONDS:
+            for i, process in children.items():
+                if process.poll() is None:
+                    logger.warning(f"Process {i} did not stop in time, killing it")
+                    process.kill()
+        for i, process in list(children.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if stopping_since is not None or code == 0:
+                del children[i]
+                continue
+            logger.warning(f"Process {i} exited with {code}, restarting")
+            time.sleep(RESTART_DELAY_SECONDS)
+            children[i] = _spawn(i, shard_count, groups[i])
+
+
+if __name__ == "__main__":
+    main()
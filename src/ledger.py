@@ -0,0 +1,129 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from src import db, metrics
+from src.constants import (
+    LEDGER_BATCH_SIZE,
+    LEDGER_FLUSH_SECONDS,
+    LEDGER_MAX_BUFFERED_ROWS,
+)
+from src.spend import spend
+from src.utils import logger
+
+INSERT_SQL = "INSERT INTO JaduGPT (User, UserID, Cost, Datetime) VALUES (%s, %s,%s, %s)"
+MAX_BACKOFF_SECONDS = 60
+
+
+class LedgerWriter:
+    """Buffers JaduGPT cost rows and writes them in batches off the reply path.
+
+    A flush happens once batch_size rows are waiting or every flush_seconds,
+    whichever comes first. Failed batches go back to the front of the buffer
+    and are retried with exponential backoff. The task is never cancelled
+    mid-write, close() lets it finish its current flush and stop.
+    """
+
+    def __init__(self, batch_size: int, flush_seconds: float, max_buffered_rows: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffered_rows = max_buffered_rows
+        self._rows: List[Tuple[str, str, Decimal, str]] = []
+        # created on first use so they bind to the running loop
+        self._wake: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def record(self, user, cost: Decimal, at: Optional[datetime] = None):
+        at = at or datetime.now()
+        self._rows.append((str(user), str(user.id), Decimal(cost), str(at)))
+        spend.record(user.id, cost, at=at)
+        if len(self._rows) > self.max_buffered_rows:
+            dropped = len(self._rows) - self.max_buffered_rows
+            del self._rows[:dropped]
+            logger.error(f"Ledger buffer full, dropped {dropped} cost rows")
+        if len(self._rows) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def _flush_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @asynccontextmanager
+    async def paused(self):
+        """Holds off flushes, so no rows are written while the spend windows are rebuilt."""
+        async with self._flush_lock():
+            yield
+
+    async def flush(self) -> bool:
+        async with self._flush_lock():
+            while self._rows:
+                batch = self._rows[: self.batch_size]
+                del self._rows[: len(batch)]
+                try:
+                    await db.pool.executemany(INSERT_SQL, batch)
+                except Exception as e:
+                    self._rows[:0] = batch
+                    self._failures += 1
+                    logger.exception(e)
+                    return False
+                await spend.written((user_id, cost, at) for _, user_id, cost, at in batch)
+            self._failures = 0
+            return True
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            if not await self.flush():
+                try:
+                    await asyncio.wait_for(
+                        self._stop.wait(), min(2 ** self._failures, MAX_BACKOFF_SECONDS)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, attempts: int = 3):
+        if self._task is not None:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        for attempt in range(attempts):
+            if await self.flush():
+                return
+            await asyncio.sleep(attempt + 1)
+        logger.error(f"Shutting down with {len(self._rows)} unwritten cost rows")
+
+
+ledger = LedgerWriter(
+    batch_size=LEDGER_BATCH_SIZE,
+    flush_seconds=LEDGER_FLUSH_SECONDS,
+    max_buffered_rows=LEDGER_MAX_BUFFERED_ROWS,
+)
+
+metrics.Gauge(
+    "jadugpt_ledger_pending_rows",
+    "Cost rows buffered and not yet written to the database",
+    fn=lambda: ledger.pending,
+)
@@ -1,3 +1,4 @@
+from src.startup import timer
 import discord
 from discord import Message as DiscordMessage
 import logging
@@ -5,20 +6,32 @@ from src.base import Message, Conversation
 from src.constants import (
     BOT_INVITE_URL,
     DISCORD_BOT_TOKEN,
-    EXAMPLE_CONVOS,
     ACTIVATE_THREAD_PREFX,
     MAX_THREAD_MESSAGES,
     SECONDS_DELAY_RECEIVING_MSG,
+    STREAM_REPLIES,
+    SHARD_COUNT,
+    SHARD_IDS,
+    load_config,
 )
 import asyncio
+import signal
 from src.utils import (
     logger,
     should_block,
     close_thread,
     is_last_message_stale,
-    discord_message_to_message,
+    has_queue_priority,
+    queue_notifier,
 )
-from src import completion
+from src import completion, db, metrics, search, startup, tracing
+from src.blocklist import blocklist
+from src.spend import spend
+from src.store import store
+from src.threadlimit import thread_limiter
+from src.ledger import ledger
+from src.history import history
+from src.debounce import ThreadDebouncer
 from src.completion import generate_completion_response, process_response,generate_summary
 
 from src.moderation import (
@@ -26,48 +39,18 @@ from src.moderation import (
     send_moderation_blocked_message,
     send_moderation_flagged_message,
 )
-import pandas as pd
-from datetime import datetime, timedelta
-import os
-from dotenv import load_dotenv
-import MySQLdb
-import requests
-import time
+from datetime import datetime
 
 
-def choose_model_for_user(user_id):
+async def choose_model_for_user(user_id):
 
     skip_values = ['1104163607979249736','1105175899743203358']    
     
     if str(user_id) not in skip_values:
 
-        connection = MySQLdb.connect(
-                host= os.getenv("HOST"),
-                user=os.getenv("USERNAME2"),
-                password= os.getenv("PASSWORD"),
-                db= os.getenv("DATABASE"),
-                ssl=os.getenv("SSL_CERT")
-            )
-
-        mycursor = connection.cursor()
-        
-        # Get the current date and time
-        current_date = datetime.now()
-
-        # Calculate the start date for the previous week
-        start_date = current_date - timedelta(days=1)
-
-        # Generate the SQL query
-        query = f"SELECT SUM(Cost) as TotalCost FROM JaduGPT WHERE UserID = '{user_id}' AND Datetime >= '{start_date}' AND Datetime <= '{current_date}';"
-
-        mycursor.execute(query)
-        result = mycursor.fetchall()
-
-        try:
-            # Get the total cost from the result
-            total_cost = float(result[0][0])
-            print(total_cost)
-        except:
+        # spend over the last day, kept in memory and reconciled with JaduGPT
+        total_cost = await spend.total(user_id)
+        if total_cost is None:
             return 'gpt-3.5-turbo'
 
         # Return the total model
@@ -78,23 +61,6 @@ def choose_model_for_user(user_id):
     else:
         return 'gpt-3.5-turbo'
 
-def check_network_availability():
-    url = 'https://www.google.com'
-    while True:
-        try:
-            response = requests.head(url, timeout=5)
-            if response.status_code == 200:
-                print("Network is available. Continuing...")
-                # Your code to execute if the network is available
-                break  # Exit the loop and continue with the rest of your code
-            else:
-                print("Unable to connect to Google. Retrying in 5 seconds...")
-        except requests.ConnectionError:
-            print("No network connection. Retrying in 5 seconds...")
-        time.sleep(5)  # Wait for 5 seconds before retrying
-
-check_network_availability()
-
 logging.basicConfig(
     format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
 )
@@ -102,16 +68,35 @@ logging.basicConfig(
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = discord.Client(intents=intents)
+if SHARD_COUNT:
+    # one gateway connection per shard, this process runs SHARD_IDS or all of them
+    client = discord.AutoShardedClient(
+        intents=intents,
+        shard_count=None if SHARD_COUNT == "auto" else int(SHARD_COUNT),
+        shard_ids=SHARD_IDS,
+    )
+else:
+    client = discord.Client(intents=intents)
+# with shard groups in several processes, shard 0's process does the once-per-bot work
+PRIMARY_PROCESS = SHARD_IDS is None or 0 in SHARD_IDS
 tree = discord.app_commands.CommandTree(client)
+debouncer = ThreadDebouncer(delay=SECONDS_DELAY_RECEIVING_MSG)
+metrics.Gauge(
+    "jadugpt_debounce_pending",
+    "Threads with a reply waiting out the debounce delay or being generated",
+    fn=lambda: debouncer.pending,
+)
 
 
 @client.event
 async def on_ready():
+    timer.lap("gateway")
     logger.info(f"We have logged in as {client.user}. Invite URL: {BOT_INVITE_URL}")
+    with timer.phase("config"):
+        config = load_config()
     completion.MY_BOT_NAME = client.user.name
     completion.MY_BOT_EXAMPLE_CONVOS = []
-    for c in EXAMPLE_CONVOS:
+    for c in config.example_conversations:
         messages = []
         for m in c.messages:
             if m.user == "Lenard":
@@ -119,7 +104,26 @@ async def on_ready():
             else:
                 messages.append(m)
         completion.MY_BOT_EXAMPLE_CONVOS.append(Conversation(messages=messages))
-    await tree.sync()
+    # a new gateway session may have missed message events
+    history.invalidate()
+    search.start()
+    with timer.phase("db_pool"):
+        await db.pool.start()
+    with timer.phase("blocklist"):
+        await blocklist.start()
+    if PRIMARY_PROCESS or not store.shared:
+        with timer.phase("spend_and_threads"):
+            await spend.start()
+            await thread_limiter.start()
+    with timer.phase("store"):
+        await store.start()
+    ledger.start()
+    with timer.phase("metrics"):
+        await metrics.start()
+    if PRIMARY_PROCESS:
+        with timer.phase("tree_sync"):
+            await tree.sync()
+    timer.report()
 
 # /chat message:
 @tree.command(name="google", description="Create a new thread starting with a google search by GPT")
@@ -128,7 +132,11 @@ async def on_ready():
 @discord.app_commands.checks.bot_has_permissions(send_messages=True)
 @discord.app_commands.checks.bot_has_permissions(view_channel=True)
 @discord.app_commands.checks.bot_has_permissions(manage_threads=True)
+@tracing.traced("google_command")
 async def chat_command(int: discord.Interaction, message: str):
+    tracing.annotate(
+        interaction_id=int.id, thread_id=int.channel_id, user_id=int.user.id
+    )
     try:
         # # only support creating thread in text channel
         # if not isinstance(int.channel, discord.TextChannel):
@@ -143,38 +151,18 @@ async def chat_command(int: discord.Interaction, message: str):
         if should_block(guild=int.guild):
             return
         
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
-        
-        sql = f"SELECT * FROM JaduBlockedUsers WHERE BlockedUserID = {int.user.id} AND IsBlocked = 1"
-
-        mycursor.execute(sql)
-        result = mycursor.fetchall()
-
-        channel_messages = [
-                    discord_message_to_message(message)
-                    async for message in thread.history(limit=MAX_THREAD_MESSAGES)
-                ]
-        channel_messages = [x for x in channel_messages if x is not None]
-        channel_messages.reverse()
+        channel_messages = await history.get(thread)
 
         google_messages_count = sum(message.text.startswith('/google') for message in channel_messages)
 
         if google_messages_count < 2:
-            if len(result) == 0:
+            if not blocklist.is_blocked(int.user.id):
                 user = int.user
                 logger.info(f"Chat command by {user} {message[:20]}")
 
                 try:
                     # moderate the message
-                    flagged_str, blocked_str = moderate_message(message=message, user=user)
+                    flagged_str, blocked_str = await moderate_message(message=message, user=user)
                     await send_moderation_blocked_message(
                         guild=int.guild,
                         user=user,
@@ -210,13 +198,21 @@ async def chat_command(int: discord.Interaction, message: str):
                 async with thread.typing():
                     # fetch completion
                     messages = [Message(user=user.name, text=message)]
-                    response_data = await generate_summary(
-                        messages=messages, user=user, gptmodel=choose_model_for_user(message.author.id)
-                    )
+                    with metrics.completions_in_flight.track():
+                        response_data = await generate_summary(
+                            messages=messages,
+                            user=user,
+                            gptmodel=await choose_model_for_user(user.id),
+                            priority=has_queue_priority(user),
+                            on_queued=queue_notifier(thread),
+                        )
+                    metrics.completions.inc(status=response_data.status.name)
+                    tracing.annotate(status=response_data.status.name)
                     # send the result
-                    await process_response(
-                        user=user, thread=thread, response_data=response_data
-                    )
+                    with metrics.stage("discord_send"):
+                        await process_response(
+                            user=user, thread=thread, response_data=response_data
+                        )
             else:
                 try:
                     embed = discord.Embed(
@@ -274,46 +270,8 @@ async def thread_command(int: discord.Interaction):
         if should_block(guild=int.guild):
             return
                 
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
-        
-        sql = f"SELECT * FROM JaduBlockedUsers WHERE BlockedUserID = {int.user.id} AND IsBlocked = 1"
-
-        mycursor.execute(sql)
-        result = mycursor.fetchall()
-
-        sql2 = f"SELECT * FROM JaduThreads WHERE UserID = {int.user.id}"
-
-        mycursor.execute(sql2)
-        result2 = mycursor.fetchall()
-
-        def count_elements_less_than_10_minutes(tuple_list):
-            current_time = datetime.now()
-            count = 0
-
-            for element in tuple_list:
-                timestamp = datetime.strptime(element[0], '%Y-%m-%d %H:%M:%S.%f')
-                time_difference = current_time - timestamp
-
-                if time_difference.total_seconds() / 60 <= 10:
-                    count += 1
-
-                if element[2] == 'allow' and time_difference.total_seconds() / 60 <= 10:
-                    return 0
-
-            return count
-        
-        previous_10min_threads = count_elements_less_than_10_minutes(result2)
-        
-        if previous_10min_threads <= 1:
-            if len(result) == 0:
+        if await thread_limiter.allowed(int.user.id):
+            if not blocklist.is_blocked(int.user.id):
                 user = int.user
 
                 try:
@@ -338,12 +296,12 @@ async def thread_command(int: discord.Interaction):
 
                     await thread.send(f"{int.user.mention}")
 
-                    query = "INSERT INTO JaduThreads (Date, UserID) VALUES  (%s, %s)"
-                
-                    val = ({str(datetime.now())}, {str(int.user.id)})
-                    mycursor.execute(query, val)
-                    connection.commit()
-                    connection.close()
+                    started = datetime.now()
+                    await thread_limiter.started(int.user.id, started)
+                    await db.pool.execute(
+                        "INSERT INTO JaduThreads (Date, UserID) VALUES  (%s, %s)",
+                        (str(started), str(int.user.id)),
+                    )
 
                     embed = discord.Embed(
                                     color=discord.Color.green(),
@@ -397,22 +355,7 @@ async def deny_command(int: discord.Interaction, message: str):
         if should_block(guild=int.guild):
             return
                 
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
-
-        sql = "INSERT INTO JaduBlockedUsers (Moderator, BlockedUserID, DateTime, IsBlocked) VALUES  (%s, %s,%s, %s)"
-        
-        val = ({str(int.user)}, {str(message)}, {str(datetime.now())}, 1)
-        mycursor.execute(sql, val)
-        connection.commit()
-        connection.close()
+        await blocklist.block(message, moderator=int.user)
 
         try:
 
@@ -453,27 +396,11 @@ async def allow_command(int: discord.Interaction, message: str):
         if should_block(guild=int.guild):
             return
                 
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
-
-        sql = "UPDATE JaduBlockedUsers SET IsBlocked = 0 WHERE BlockedUserID = %s"
-        
-        val = ({str(message)})
-        mycursor.execute(sql, val)
-        connection.commit()
-        
-
-        sql2 = f"SELECT * FROM JaduThreads WHERE UserID = {str(message)}"
+        await blocklist.allow(message)
 
-        mycursor.execute(sql2)
-        result2 = mycursor.fetchall()
+        result2 = await db.pool.fetchall(
+            "SELECT * FROM JaduThreads WHERE UserID = %s", (str(message),)
+        )
 
         def get_most_recent_datetime(tuple_list):
             most_recent_datetime = None
@@ -488,12 +415,11 @@ async def allow_command(int: discord.Interaction, message: str):
         most_recent_datetime  = get_most_recent_datetime(result2)
 
 
-        sql3 = "UPDATE JaduThreads SET allowed = 'allow' WHERE Date = %s AND UserID = %s"
-        
-        val = ({str(most_recent_datetime)}, {str(message)})
-        mycursor.execute(sql3, val)
-        connection.commit()
-        connection.close()
+        await db.pool.execute(
+            "UPDATE JaduThreads SET allowed = 'allow' WHERE Date = %s AND UserID = %s",
+            (str(most_recent_datetime), str(message)),
+        )
+        await thread_limiter.allow(message, most_recent_datetime)
 
 
         try:
@@ -524,7 +450,7 @@ async def allow_command(int: discord.Interaction, message: str):
 @discord.app_commands.checks.bot_has_permissions(send_messages=True)
 @discord.app_commands.checks.bot_has_permissions(view_channel=True)
 @discord.app_commands.checks.bot_has_permissions(manage_threads=True)
-async def allow_command(int: discord.Interaction):
+async def costs_command(int: discord.Interaction):
     try:
         # only support creating thread in text channel
         if not isinstance(int.channel, discord.Thread):
@@ -534,22 +460,9 @@ async def allow_command(int: discord.Interaction):
         if should_block(guild=int.guild):
             return
                 
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        mycursor = connection.cursor()
-
         sql = "SELECT User, UserID, TotalCost FROM (SELECT User, UserID, SUM(Cost) AS TotalCost FROM JaduGPT GROUP BY User, UserID UNION ALL SELECT 'Grand Total', NULL, SUM(Cost) AS TotalCost FROM JaduGPT) AS result;"
-                
-        mycursor.execute(sql)
-        result = mycursor.fetchall()
-        connection.commit()
-        connection.close()
+
+        result = await db.pool.fetchall(sql)
 
         try:
 
@@ -587,42 +500,81 @@ async def allow_command(int: discord.Interaction):
             f"Failed to start chat, please try again. If the error continues reach out to moderators with specifications of when the error occured.", ephemeral=True
         )
 
+@tracing.traced("reply_in_thread")
+async def reply_in_thread(message: DiscordMessage, thread: discord.Thread):
+    if is_last_message_stale(
+        interaction_message=message,
+        last_message=thread.last_message,
+        bot_id=client.user.id,
+    ):
+        # there is another message, so ignore this one
+        return
+
+    logger.info(
+        f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+    )
+
+    channel_messages = await history.get(thread)
+
+    # generate the response
+    async with thread.typing():
+        with metrics.completions_in_flight.track():
+            response_data = await generate_completion_response(
+                messages=channel_messages,
+                user=message.author,
+                gptmodel=await choose_model_for_user(message.author.id),
+                stream_to=thread if STREAM_REPLIES else None,
+                priority=has_queue_priority(message.author),
+                on_queued=queue_notifier(thread),
+            )
+    metrics.completions.inc(status=response_data.status.name)
+    tracing.annotate(status=response_data.status.name)
+
+    if is_last_message_stale(
+        interaction_message=message,
+        last_message=thread.last_message,
+        bot_id=client.user.id,
+    ):
+        # there is another message and its not from us, so ignore this response
+        for sent_message in response_data.sent_messages or []:
+            await sent_message.delete()
+        return
+
+    # send response, shielded so a newer message cannot cut it off half way
+    with metrics.stage("discord_send"):
+        await asyncio.shield(
+            process_response(
+                user=message.author, thread=thread, response_data=response_data
+            )
+        )
+
+
 # calls for each message
 @client.event
+@tracing.traced("on_message")
 async def on_message(message: DiscordMessage):
+    tracing.annotate(
+        message_id=message.id, thread_id=message.channel.id, user_id=message.author.id
+    )
     try:
-        connection = MySQLdb.connect(
-            host= os.getenv("HOST"),
-            user=os.getenv("USERNAME2"),
-            password= os.getenv("PASSWORD"),
-            db= os.getenv("DATABASE"),
-            ssl=os.getenv("SSL_CERT")
-        )
-
-        
+        history.observe(message)
 
-        mycursor = connection.cursor()
-        
-        sql = f"SELECT * FROM JaduBlockedUsers WHERE BlockedUserID = {message.author.id} AND IsBlocked = 1"
+        # ignore messages from the bot, and other bots
+        if message.author == client.user or message.author.bot:
+            return
 
-        mycursor.execute(sql)
-        result = mycursor.fetchall()
-        connection.commit()
-        connection.close()
+        # block servers not in allow list
+        if should_block(guild=message.guild):
+            return
 
-        choose_model_for_user(message.author.id)
+        # until the blocklist has loaded everyone counts as blocked, stay
+        # quiet rather than tell every user they are
+        if not blocklist.loaded:
+            return
 
-        if len(result) == 0:
+        if not blocklist.is_blocked(message.author.id):
             if str(message.content[0:2]) != '<@':
                 if str(message.content[0:1]) != '/':
-                    
-                    # block servers not in allow list
-                    if should_block(guild=message.guild):
-                        return
-
-                    # ignore messages from the bot
-                    if message.author == client.user:
-                        return
 
                     # ignore messages not in a thread
                     channel = message.channel
@@ -649,7 +601,7 @@ async def on_message(message: DiscordMessage):
                         return
 
                     # moderate the message
-                    flagged_str, blocked_str = moderate_message(
+                    flagged_str, blocked_str = await moderate_message(
                         message=message.content, user=message.author
                     )
                     await send_moderation_blocked_message(
@@ -691,46 +643,9 @@ async def on_message(message: DiscordMessage):
                             )
                         )
 
-                    # wait a bit in case user has more messages
-                    if SECONDS_DELAY_RECEIVING_MSG > 0:
-                        await asyncio.sleep(SECONDS_DELAY_RECEIVING_MSG)
-                        if is_last_message_stale(
-                            interaction_message=message,
-                            last_message=thread.last_message,
-                            bot_id=client.user.id,
-                        ):
-                            # there is another message, so ignore this one
-                            return
-
-                    logger.info(
-                        f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
-                    )
-
-                    channel_messages = [
-                        discord_message_to_message(message)
-                        async for message in thread.history(limit=MAX_THREAD_MESSAGES)
-                    ]
-                    channel_messages = [x for x in channel_messages if x is not None]
-                    channel_messages.reverse()
-
-                    # generate the response
-                    async with thread.typing():
-                        response_data = await generate_completion_response(
-                            messages=channel_messages, user=message.author, gptmodel=choose_model_for_user(message.author.id)
-                        )
-
-                    if is_last_message_stale(
-                        interaction_message=message,
-                        last_message=thread.last_message,
-                        bot_id=client.user.id,
-                    ):
-                        # there is another message and its not from us, so ignore this response
-                        return
-
-                    # send response
-                    await process_response(
-                        user=message.author, thread=thread, response_data=response_data
-                    )
+                    # wait a bit in case user has more messages, a newer message
+                    # restarts the wait and cancels a reply still being generated
+                    debouncer.submit(thread.id, lambda: reply_in_thread(message, thread))
         else:
             try:
                 embed = discord.Embed(
@@ -752,4 +667,52 @@ async def on_message(message: DiscordMessage):
         logger.exception(e)
 
 
-client.run(DISCORD_BOT_TOKEN)
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    history.edit(payload.channel_id, payload.message_id, payload.data.get("content"))
+
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    history.delete(payload.channel_id, payload.message_id)
+
+
+@client.event
+async def on_thread_update(before: discord.Thread, after: discord.Thread):
+    if after.archived or after.locked:
+        history.forget(after.id)
+
+
+@client.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    history.forget(payload.thread_id)
+
+
+async def main():
+    timer.lap("imports")
+    with timer.phase("readiness"):
+        await startup.check_readiness()
+    async with client:
+        # docker, systemd and the launcher stop the bot with SIGTERM, close
+        # the client so the cleanup below runs
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.create_task(client.close())
+        )
+        try:
+            await client.start(DISCORD_BOT_TOKEN)
+        finally:
+            # write out any buffered cost rows before the pool goes away
+            await ledger.close()
+            await db.pool.close()
+            await store.close()
+            await search.close()
+            await metrics.close()
+            tracing.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
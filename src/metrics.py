@@ -0,0 +1,244 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+
+from src import tracing
+from src.constants import METRICS_HOST, METRICS_PORT
+from src.utils import logger
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+_runner: Optional[web.AppRunner] = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[Tuple[str, LabelValues, Sequence[str], float]]:
+        """(name suffix, label values, extra label names, value) for each sample."""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra_names, value in self._samples():
+            names = self.labelnames + tuple(extra_names)
+            labels = _format_labels(names, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [("_total", k, (), v) for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    Pass fn to read the value at scrape time instead of setting it. With
+    labels, fn returns a dict from label value tuples to values.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        fn: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Counts the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        values = self._values
+        if self._fn is not None:
+            try:
+                result = self._fn()
+            except Exception as e:
+                logger.info(f"Gauge {self.name} failed: {e}")
+                return []
+            values = result if isinstance(result, dict) else {(): result}
+        return [("", k, (), v) for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label values: (count per bucket, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * len(self.buckets), [0.0, 0])
+        counts, totals = entry
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    def _samples(self):
+        samples = []
+        for key, (counts, totals) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    ("_bucket", key + (_format_value(bound),), ("le",), cumulative)
+                )
+            samples.append(("_sum", key, (), totals[0]))
+            samples.append(("_count", key, (), totals[1]))
+        return samples
+
+
+stage_seconds = Histogram(
+    "jadugpt_stage_seconds",
+    "Time spent in each stage of handling a message",
+    ["stage"],
+)
+completions = Counter(
+    "jadugpt_completions",
+    "Completions finished, by CompletionResult status",
+    ["status"],
+)
+completions_in_flight = Gauge(
+    "jadugpt_completions_in_flight", "Completions currently being generated"
+)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Times the block into jadugpt_stage_seconds and as a tracing span.
+
+    Cancelled blocks are not counted in the histogram.
+    """
+    start = time.perf_counter()
+    cancelled = False
+    try:
+        with tracing.span(name, **attributes):
+            yield
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            stage_seconds.observe(time.perf_counter() - start, stage=name)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start():
+    """Serves /metrics on METRICS_HOST:METRICS_PORT, unless METRICS_PORT is 0."""
+    global _runner
+    if _runner is not None or not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        logger.warning(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    logger.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def close():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
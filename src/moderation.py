@@ -2,21 +2,105 @@ from src.constants import (
     SERVER_TO_MODERATION_CHANNEL,
     MODERATION_VALUES_FOR_BLOCKED,
     MODERATION_VALUES_FOR_FLAGGED,
+    MODERATION_BATCH_WINDOW_SECONDS,
+    MODERATION_MAX_BATCH,
+    MODERATION_CACHE_SIZE,
+    MODERATION_CACHE_TTL_SECONDS,
+    MODERATION_MODEL,
 )
-from openai import OpenAI
-
-client = OpenAI()
-from typing import Optional, Tuple
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Set, Tuple
 import discord
+from src import metrics, openai_client
+from src.cache import TTLCache
 from src.utils import logger
 
 
-def moderate_message(
-    message: str, user: str
-) -> Tuple[str, str]:  # [flagged_str, blocked_str]
-    moderation_response = client.moderations.create(input=message, model="text-moderation-latest")
-    category_scores = moderation_response.results[0].category_scores or {}
+class ModerationBatcher:
+    """Coalesces moderation inputs that arrive close together into one request.
+
+    Each caller awaits its own category scores; the first input of a batch
+    starts a short timer and the batch is sent when it fires or fills up.
+    Scores are cached by normalized text, and identical inputs that are
+    already waiting share one slot in the batch.
+    """
+
+    def __init__(self, window_seconds: float, max_batch: int, cache: TTLCache):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.cache = cache
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._in_flight: Dict[bytes, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        normalized = " ".join(text.split()).casefold()
+        return hashlib.sha256(f"{MODERATION_MODEL}\0{normalized}".encode()).digest()
+
+    async def scores(self, text: str) -> Dict[str, float]:
+        key = self._key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._in_flight[key] = loop.create_future()
+            future.add_done_callback(lambda f: self._done(key, f))
+            self._pending.append((text, future))
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window_seconds, self._flush)
+        # shielded so one cancelled caller does not fail the others sharing it
+        return await asyncio.shield(future)
+
+    def _done(self, key: bytes, future: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.cache.set(key, future.result())
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[: self.max_batch]
+            del self._pending[: len(batch)]
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            results = await openai_client.moderation([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(
+                    result.category_scores.model_dump(by_alias=True)
+                    if result.category_scores
+                    else {}
+                )
 
+
+batcher = ModerationBatcher(
+    window_seconds=MODERATION_BATCH_WINDOW_SECONDS,
+    max_batch=MODERATION_MAX_BATCH,
+    cache=TTLCache(MODERATION_CACHE_SIZE, ttl=MODERATION_CACHE_TTL_SECONDS),
+)
+
+
+def moderation_verdict(
+    category_scores: Dict[str, float], user: str
+) -> Tuple[str, str]:  # [flagged_str, blocked_str]
     blocked_str = ""
     flagged_str = ""
     for category, score in category_scores.items():
@@ -30,6 +114,14 @@ def moderate_message(
     return (flagged_str, blocked_str)
 
 
+async def moderate_message(
+    message: str, user: str
+) -> Tuple[str, str]:  # [flagged_str, blocked_str]
+    with metrics.stage("moderation"):
+        scores = await batcher.scores(message)
+    return moderation_verdict(scores, user)
+
+
 async def fetch_moderation_channel(
     guild: Optional[discord.Guild],
 ) -> Optional[discord.abc.GuildChannel]:
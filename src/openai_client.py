@@ -0,0 +1,115 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+
+from openai import AsyncOpenAI
+
+from src.constants import (
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_DEFAULT_MAX_CONCURRENCY,
+    OPENAI_MAX_QUEUED,
+    MODERATION_MODEL,
+)
+from src import metrics, resilience
+
+# retries are done by src.resilience so they are visible to its circuit breakers
+client = AsyncOpenAI(max_retries=0)
+
+
+class ModelBusy(Exception):
+    pass
+
+
+class _ModelLane:
+    def __init__(self, model: str, concurrency: int, max_queued: int):
+        self.model = model
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            raise ModelBusy(f"{self.waiting} requests already waiting for {self.model}")
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+_lanes: Dict[str, _ModelLane] = {}
+
+metrics.Gauge(
+    "jadugpt_openai_lane_waiting",
+    "Requests waiting for a concurrency slot, per model",
+    ["model"],
+    fn=lambda: {(m,): l.waiting for m, l in _lanes.items()},
+)
+metrics.Gauge(
+    "jadugpt_openai_lane_in_flight",
+    "Requests holding a concurrency slot, per model",
+    ["model"],
+    fn=lambda: {(m,): l.in_flight for m, l in _lanes.items()},
+)
+
+
+def lane(model: str) -> _ModelLane:
+    if model not in _lanes:
+        _lanes[model] = _ModelLane(
+            model,
+            OPENAI_MAX_CONCURRENCY.get(model, OPENAI_DEFAULT_MAX_CONCURRENCY),
+            OPENAI_MAX_QUEUED,
+        )
+    return _lanes[model]
+
+
+async def chat_completion(model: str, messages: List[dict], **kwargs):
+    async def attempt():
+        async with lane(model).slot():
+            with metrics.stage("openai_call"):
+                return await client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+
+    return await resilience.call("openai.chat", attempt)
+
+
+@asynccontextmanager
+async def chat_completion_stream(model: str, messages: List[dict], **kwargs):
+    """Opens a streamed completion, holding the model's slot until it is closed.
+
+    Only opening the stream is retried, a stream that breaks half way fails the reply.
+    The openai_call stage covers the whole stream, including the edits made while reading it.
+    """
+    async with lane(model).slot():
+        with metrics.stage("openai_call"):
+            stream = await resilience.call(
+                "openai.chat",
+                lambda: client.chat.completions.create(
+                    model=model, messages=messages, stream=True, **kwargs
+                ),
+            )
+            try:
+                yield stream
+            finally:
+                await stream.close()
+
+
+async def moderation(input: Union[str, List[str]], model: str = MODERATION_MODEL):
+    async def attempt():
+        async with lane(model).slot():
+            return await client.moderations.create(input=input, model=model)
+
+    response = await resilience.call("openai.moderation", attempt)
+    return response.results
@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from src.tokens import tokens
+
+CHUNK_WORDS = 120
+CHUNK_OVERLAP_WORDS = 20
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TERM = re.compile(r"\w+")
+
+
+def terms(text: str) -> List[str]:
+    return _TERM.findall(text.casefold())
+
+
+def chunk_text(text: str, size: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    words = text.split()
+    step = max(size - overlap, 1)
+    return [" ".join(words[i : i + size]) for i in range(0, max(len(words) - overlap, 1), step)]
+
+
+def bm25_scores(query: str, documents: List[str]) -> List[float]:
+    """Okapi BM25 score of every document for the query."""
+    query_terms = set(terms(query))
+    if not documents or not query_terms:
+        return [0.0] * len(documents)
+    frequencies = [Counter(terms(document)) for document in documents]
+    lengths = [sum(f.values()) for f in frequencies]
+    average_length = (sum(lengths) / len(lengths)) or 1.0
+    n = len(documents)
+    idf = {}
+    for term in query_terms:
+        containing = sum(1 for f in frequencies if term in f)
+        idf[term] = math.log(1 + (n - containing + 0.5) / (containing + 0.5))
+    scores = []
+    for f, length in zip(frequencies, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        scores.append(
+            sum(
+                idf[term] * f[term] * (BM25_K1 + 1) / (f[term] + norm)
+                for term in query_terms
+                if term in f
+            )
+        )
+    return scores
+
+
+async def select_chunks(
+    question: str, pages: List[str], budget_tokens: int, model: str
+) -> List[List[str]]:
+    """Best matching chunks of each page that fit in budget_tokens together.
+
+    Returns one list per page, with chunks kept in their original order so
+    each page still reads top to bottom.
+    """
+    located: List[Tuple[int, int, str]] = [
+        (page, position, chunk)
+        for page, text in enumerate(pages)
+        for position, chunk in enumerate(chunk_text(text))
+        if chunk
+    ]
+    scores = bm25_scores(question, [chunk for _, _, chunk in located])
+    counts = await tokens.count_many([chunk for _, _, chunk in located], model)
+
+    ranked = sorted(range(len(located)), key=lambda i: scores[i], reverse=True)
+    # chunks sharing no term with the question only matter if nothing matches
+    ranked = [i for i in ranked if scores[i] > 0] or ranked
+    chosen = []
+    used = 0
+    for i in ranked:
+        if used + counts[i] > budget_tokens:
+            continue
+        chosen.append(i)
+        used += counts[i]
+
+    selected: List[List[str]] = [[] for _ in pages]
+    for i in sorted(chosen, key=lambda i: located[i][:2]):
+        page, _, chunk = located[i]
+        selected[page].append(chunk)
+    return selected
@@ -0,0 +1,207 @@
+import asyncio
+import email.utils
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+import openai
+
+from src import metrics
+from src.constants import (
+    RETRY_ATTEMPTS,
+    RETRY_BASE_DELAY_SECONDS,
+    RETRY_MAX_DELAY_SECONDS,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+)
+from src.utils import logger
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint that is known to be failing."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status
+    return None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether a failure is worth retrying: rate limits, 5xx and dropped connections."""
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(
+        exc,
+        (openai.APIConnectionError, aiohttp.ClientConnectionError, asyncio.TimeoutError),
+    )
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After if it sent one."""
+    if isinstance(exc, openai.APIStatusError):
+        headers = exc.response.headers
+    else:
+        headers = getattr(exc, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets one probe through to test recovery.
+
+    Closed: calls go through and consecutive transient failures are counted.
+    Open: calls raise CircuitOpen until reset_seconds have passed.
+    Half open: a single probe is allowed; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit {self.name} {self.state} -> {state}")
+            self.state = state
+
+    def before(self) -> bool:
+        """Checks the circuit before an attempt. Returns True if this attempt is the probe."""
+        if self.state == CLOSED:
+            return False
+        retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        raise CircuitOpen(self.name, max(retry_in, 0.0))
+
+    def success(self):
+        self._probing = False
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._set_state(OPEN)
+
+    def abandon(self):
+        """The probe was cancelled before it got an answer, let another one through."""
+        self._probing = False
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+        )
+    return _breakers[name]
+
+
+def states() -> Dict[str, dict]:
+    """Current state of every breaker, keyed by endpoint name."""
+    return {name: b.snapshot() for name, b in _breakers.items()}
+
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.Gauge(
+    "jadugpt_circuit_state",
+    "Circuit breaker state per endpoint: 0 closed, 1 half open, 2 open",
+    ["endpoint"],
+    fn=lambda: {(n,): _STATE_VALUES[b.state] for n, b in _breakers.items()},
+)
+
+
+def backoff(attempt: int) -> float:
+    """Full jitter exponential backoff for the given retry number (starting at 1)."""
+    ceiling = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+async def call(endpoint: str, attempt: Callable[[], Awaitable[T]]) -> T:
+    """Runs attempt through the endpoint's breaker, retrying transient failures."""
+    circuit = breaker(endpoint)
+    for n in range(1, RETRY_ATTEMPTS + 1):
+        probe = circuit.before()
+        try:
+            result = await attempt()
+        except Exception as e:
+            if not is_transient(e):
+                if _status(e) is not None:
+                    # the endpoint answered, it just did not like the request
+                    circuit.success()
+                elif probe:
+                    circuit.abandon()
+                raise
+            circuit.failure()
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff(n)
+            if n == RETRY_ATTEMPTS or delay > RETRY_MAX_DELAY_SECONDS:
+                raise
+            logger.info(f"{endpoint} failed ({e}), retry {n} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            if probe:
+                circuit.abandon()
+            raise
+        circuit.success()
+        return result
@@ -0,0 +1,235 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+from src import metrics
+from src.constants import OPENAI_RATE_LIMITS, OPENAI_DEFAULT_RATE_LIMIT
+from src.utils import logger
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 if it can be taken now."""
+        self._refill()
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass
+class Admission:
+    model: str
+    estimated_tokens: int
+    waited_seconds: float
+    _settled: bool = field(default=False, repr=False)
+
+
+@dataclass
+class _Request:
+    key: Hashable
+    tokens: int
+    future: asyncio.Future
+    enqueued: float
+
+
+class _ModelQueue:
+    """Fair queue in front of one model's RPM and TPM buckets.
+
+    Priority requests go first, everyone else is served round robin by key
+    so one busy user or thread cannot starve the rest.
+    """
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.priority: Deque[_Request] = deque()
+        self.queues: Dict[Hashable, Deque[_Request]] = {}
+        self.rotation: Deque[Hashable] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.priority) + sum(len(q) for q in self.queues.values())
+
+    def position(self, key: Hashable, priority: bool) -> int:
+        """1-based place a new request would take in the serving order."""
+        if priority:
+            return len(self.priority) + 1
+        ahead = len(self.queues.get(key, ()))
+        others = sum(min(len(q), ahead + 1) for k, q in self.queues.items() if k != key)
+        return len(self.priority) + others + ahead + 1
+
+    def _can_admit(self, tokens: int) -> float:
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _admit(self, tokens: int):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def try_admit(self, tokens: int) -> bool:
+        if self.depth == 0 and self._can_admit(tokens) == 0:
+            self._admit(tokens)
+            return True
+        return False
+
+    def enqueue(self, request: _Request, priority: bool):
+        if priority:
+            self.priority.append(request)
+        else:
+            if request.key not in self.queues:
+                self.queues[request.key] = deque()
+                self.rotation.append(request.key)
+            self.queues[request.key].append(request)
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        self._wake.set()
+
+    def _next(self) -> Optional[_Request]:
+        while self.priority:
+            request = self.priority[0]
+            if not request.future.cancelled():
+                return request
+            self.priority.popleft()
+        while self.rotation:
+            key = self.rotation[0]
+            queue = self.queues[key]
+            while queue and queue[0].future.cancelled():
+                queue.popleft()
+            if queue:
+                return queue[0]
+            self.rotation.popleft()
+            del self.queues[key]
+        return None
+
+    def _pop(self, request: _Request):
+        if self.priority and self.priority[0] is request:
+            self.priority.popleft()
+            return
+        key = self.rotation.popleft()
+        queue = self.queues[key]
+        queue.popleft()
+        if queue:
+            self.rotation.append(key)
+        else:
+            del self.queues[key]
+
+    async def _dispatch(self):
+        while True:
+            request = self._next()
+            if request is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            wait = self._can_admit(request.tokens)
+            if wait > 0:
+                # a priority request arriving meanwhile is picked up on the next pass
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pop(request)
+            if not request.future.cancelled():
+                self._admit(request.tokens)
+                request.future.set_result(None)
+
+
+class FairScheduler:
+    """Admission control for OpenAI chat requests.
+
+    Each request takes one request token and its estimated prompt plus
+    output tokens from the model's buckets before it is sent, and settles
+    the difference with the real usage afterwards.
+    """
+
+    def __init__(self):
+        self._models: Dict[str, _ModelQueue] = {}
+        self._callbacks: Set[asyncio.Task] = set()
+
+    def queue(self, model: str) -> _ModelQueue:
+        if model not in self._models:
+            rpm, tpm = OPENAI_RATE_LIMITS.get(model, OPENAI_DEFAULT_RATE_LIMIT)
+            self._models[model] = _ModelQueue(model, rpm, tpm)
+        return self._models[model]
+
+    def depth(self) -> int:
+        return sum(q.depth for q in self._models.values())
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        model: str,
+        key: Hashable,
+        estimated_tokens: int,
+        priority: bool = False,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        queue = self.queue(model)
+        # a request bigger than the whole bucket would otherwise never fit
+        tokens = min(estimated_tokens, int(queue.tokens.capacity))
+        start = time.monotonic()
+        if not queue.try_admit(tokens):
+            position = queue.position(key, priority)
+            future = asyncio.get_running_loop().create_future()
+            queue.enqueue(_Request(key, tokens, future, start), priority)
+            if on_queued is not None:
+                task = asyncio.create_task(on_queued(position))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callbacks.discard)
+            logger.info(f"Queued {model} request for {key} at position {position}")
+            try:
+                await future
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+        admission = Admission(model, tokens, time.monotonic() - start)
+        metrics.stage_seconds.observe(admission.waited_seconds, stage="scheduler_wait")
+        yield admission
+
+    def settle(self, admission: Admission, actual_tokens: int):
+        """Corrects the model's token bucket once real usage is known."""
+        if admission._settled:
+            return
+        admission._settled = True
+        difference = admission.estimated_tokens - actual_tokens
+        bucket = self.queue(admission.model).tokens
+        if difference > 0:
+            bucket.give_back(difference)
+        else:
+            bucket.take(-difference)
+
+
+scheduler = FairScheduler()
+
+metrics.Gauge(
+    "jadugpt_scheduler_queue_depth",
+    "Completions waiting for OpenAI rate limit budget, per model",
+    ["model"],
+    fn=lambda: {(m,): q.depth for m, q in scheduler._models.items()},
+)
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from src import resilience
+from src.cache import LRUCache, TTLCache
+from src.constants import (
+    GOOGLE_CSE_URL,
+    GOOGLE_FETCH_MAX_CONNECTIONS,
+    GOOGLE_FETCH_MAX_PER_HOST,
+    GOOGLE_FETCH_MAX_BYTES,
+    GOOGLE_QUERY_CACHE_SIZE,
+    GOOGLE_QUERY_CACHE_TTL_SECONDS,
+    PAGE_CACHE_SIZE,
+    PAGE_CACHE_TTL_SECONDS,
+    PAGE_CACHE_DIR,
+    PAGE_CACHE_MAX_FILES,
+    PAGE_TEXT_MAX_CHARS,
+    EXTRACT_WORKERS,
+)
+from src.extract import extract_text
+from src.utils import logger
+
+_session: Optional[aiohttp.ClientSession] = None
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class CachedPage:
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float  # unix time, so entries persisted on disk stay meaningful
+
+
+class PageCache:
+    """url -> cleaned page text, in memory and optionally on disk.
+
+    Entries younger than ttl are used as is. Older ones are kept so the
+    next fetch can revalidate them with the page's ETag/Last-Modified.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, directory: Optional[str], max_files: int):
+        self.ttl = ttl
+        self.directory = directory
+        self.max_files = max_files
+        self._memory = LRUCache(maxsize)
+        self._writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _read(self, url: str) -> Optional[CachedPage]:
+        try:
+            with open(self._path(url), "r") as f:
+                return CachedPage(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write(self, url: str, page: CachedPage):
+        with open(self._path(url), "w") as f:
+            json.dump(asdict(page), f)
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim()
+
+    def _trim(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        if len(paths) <= self.max_files:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def get(self, url: str) -> Optional[CachedPage]:
+        page = self._memory.get(url)
+        if page is None and self.directory:
+            page = await asyncio.get_running_loop().run_in_executor(None, self._read, url)
+            if page is not None:
+                self._memory.set(url, page)
+        return page
+
+    async def set(self, url: str, page: CachedPage):
+        self._memory.set(url, page)
+        if self.directory:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, url, page)
+            except OSError as e:
+                logger.exception(e)
+
+
+query_cache = TTLCache(GOOGLE_QUERY_CACHE_SIZE, ttl=GOOGLE_QUERY_CACHE_TTL_SECONDS)
+page_cache = PageCache(
+    maxsize=PAGE_CACHE_SIZE,
+    ttl=PAGE_CACHE_TTL_SECONDS,
+    directory=PAGE_CACHE_DIR,
+    max_files=PAGE_CACHE_MAX_FILES,
+)
+
+
+def session() -> aiohttp.ClientSession:
+    """Shared HTTP session for Custom Search and result pages."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=GOOGLE_FETCH_MAX_CONNECTIONS,
+                limit_per_host=GOOGLE_FETCH_MAX_PER_HOST,
+            ),
+            headers={"User-Agent": "Mozilla/5.0 (compatible; JaduGPT)"},
+        )
+    return _session
+
+
+async def close():
+    global _session, _extract_pool
+    if _session is not None:
+        await _session.close()
+        _session = None
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def _extract_pool_or_create() -> ProcessPoolExecutor:
+    global _extract_pool
+    if _extract_pool is None:
+        # forking this process, which already runs executor threads, can
+        # deadlock the child, so workers fork from a separate server. Like
+        # spawn, every worker still runs the entry module (all of src.main)
+        # as __mp_main__. Preloading it in the server does its imports once,
+        # workers then only rerun its body, no network I/O since startup
+        # stopped doing any at import
+        context = multiprocessing.get_context("forkserver")
+        entry = getattr(sys.modules["__main__"], "__spec__", None)
+        context.set_forkserver_preload(["src.extract"] + ([entry.name] if entry else []))
+        _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=context)
+    return _extract_pool
+
+
+def start():
+    """Starts the extract workers in the background, so the first /google does not wait on them."""
+    pool = _extract_pool_or_create()
+    # the first submit blocks until the server has done its preload
+    asyncio.get_running_loop().run_in_executor(None, pool.submit, extract_text, b"", 1)
+
+
+async def page_text(html: bytes, encoding: Optional[str] = None) -> str:
+    """Extracts page text in a worker process so big pages never block the loop."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _extract_pool_or_create(), extract_text, html, PAGE_TEXT_MAX_CHARS, encoding
+    )
+
+
+async def google_search(query: str, start: int = 1) -> List[dict]:
+    key = (" ".join(query.split()).casefold(), start)
+    items = query_cache.get(key)
+    if items is not None:
+        return items
+    params = {
+        "key": os.getenv("GOOGLE_API_KEY"),
+        "cx": os.getenv("GOOGLE_CSE_ID"),
+        "q": query,
+        "start": str(start),
+    }
+
+    async def attempt():
+        async with session().get(GOOGLE_CSE_URL, params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    data = await resilience.call("google.cse", attempt)
+    items = data.get("items") or []
+    query_cache.set(key, items)
+    return items
+
+
+async def fetch_text(url: str) -> str:
+    """Cleaned text of a page, from the page cache when it is still valid."""
+    cached = await page_cache.get(url)
+    if cached is not None and page_cache.is_fresh(cached):
+        return cached.text
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    async with session().get(url, headers=headers) as response:
+        if response.status == 304 and cached is not None:
+            cached.fetched_at = time.time()
+            await page_cache.set(url, cached)
+            return cached.text
+        response.raise_for_status()
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= GOOGLE_FETCH_MAX_BYTES:
+                break
+        html = b"".join(chunks)[:GOOGLE_FETCH_MAX_BYTES]
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        encoding = response.charset
+    text = await page_text(html, encoding)
+    await page_cache.set(
+        url,
+        CachedPage(text=text, etag=etag, last_modified=last_modified, fetched_at=time.time()),
+    )
+    return text
+
+
+async def fetch_texts(urls: List[str], deadline: float) -> Dict[str, str]:
+    """Fetches every url at once and returns the pages that arrived in time.
+
+    Fetches still running when the deadline passes are cancelled, failed
+    fetches are logged and left out.
+    """
+    if not urls:
+        return {}
+    tasks = {asyncio.create_task(fetch_text(url)): url for url in urls}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+        logger.info(f"Skipping {tasks[task]} as it took too long to get the data")
+    texts = {}
+    for task in done:
+        if task.exception() is not None:
+            logger.info(f"Failed to fetch {tasks[task]}: {task.exception()!r}")
+        else:
+            texts[tasks[task]] = task.result()
+    return texts
@@ -0,0 +1,127 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from src import db
+from src.constants import SPEND_WINDOW_HOURS, SPEND_RECONCILE_SECONDS
+from src.store import store
+from src.utils import logger
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _key(user_id) -> str:
+    return f"spend:{user_id}"
+
+
+def _unwritten_key(user_id) -> str:
+    return f"spend-unwritten:{user_id}"
+
+
+class SpendTracker:
+    """Sliding window of per-user spend mirrored from the JaduGPT ledger.
+
+    Events live in the shared store so every process sees the same totals.
+    The ledger record()s each cost as it happens, into a window of unwritten
+    costs, and moves it to the user's main window once its row is written.
+    Reconciling replaces the main windows with the table's rows and never
+    touches the unwritten ones, so rows still buffered by any process count
+    until they are written, and nothing depends on the table storing
+    timestamps or costs exactly as they were recorded.
+    """
+
+    def __init__(self, window: timedelta, reconcile_seconds: float):
+        self.window = window
+        self.reconcile_seconds = reconcile_seconds
+        self._writes: Set[asyncio.Task] = set()
+        self._reconcile_task: Optional[asyncio.Task] = None
+
+    def record(self, user_id, cost: float, at: Optional[datetime] = None):
+        at = at or datetime.now()
+        task = asyncio.create_task(
+            store.window_add(
+                _unwritten_key(user_id),
+                [(at.timestamp(), float(cost))],
+                self.window.total_seconds(),
+            )
+        )
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def _written(self, task: asyncio.Task):
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.exception(task.exception())
+
+    async def written(self, rows: Iterable[Tuple[str, float, object]]):
+        """Moves recorded (UserID, Cost, Datetime) rows the ledger has written to the main windows."""
+        events: Dict[str, List[Tuple[float, float]]] = defaultdict(list)
+        for user_id, cost, at in rows:
+            events[str(user_id)].append((_to_datetime(at).timestamp(), float(cost)))
+        ttl = self.window.total_seconds()
+        try:
+            for user_id, user_events in events.items():
+                # added before removing, a reader may briefly see both but never neither
+                await store.window_add(_key(user_id), user_events, ttl)
+                await store.window_remove(_unwritten_key(user_id), user_events)
+        except Exception as e:
+            # the rows are in the table, the next reconcile picks them up
+            logger.exception(e)
+
+    async def total(self, user_id) -> Optional[float]:
+        """Spend inside the window, or None if the user has no recorded spend."""
+        since = (datetime.now() - self.window).timestamp()
+        count, cost = await store.window(_key(user_id), since)
+        unwritten_count, unwritten_cost = await store.window(_unwritten_key(user_id), since)
+        if not count and not unwritten_count:
+            return None
+        return cost + unwritten_cost
+
+    async def load(self):
+        # the ledger moves written rows into this tracker
+        from src.ledger import ledger
+
+        now = datetime.now()
+        # no flush can land between the query and replacing the windows
+        async with ledger.paused():
+            rows = await db.pool.fetchall(
+                "SELECT UserID, Cost, Datetime FROM JaduGPT WHERE Datetime >= %s",
+                (str(now - self.window),),
+            )
+            events: Dict[str, List[Tuple[float, float]]] = defaultdict(list)
+            for user_id, cost, at in rows:
+                if cost is None:
+                    continue
+                events[_key(user_id)].append((_to_datetime(at).timestamp(), float(cost)))
+            ttl = self.window.total_seconds()
+            for key in set(events) | set(await store.window_keys("spend:")):
+                await store.window_replace(key, events.get(key, []), ttl, before=now.timestamp())
+        logger.info(f"Loaded spend for {len(events)} users")
+
+    async def _reconcile_forever(self):
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.exception(e)
+
+    async def start(self):
+        if self._reconcile_task is not None:
+            return
+        self._reconcile_task = asyncio.create_task(self._reconcile_forever())
+        try:
+            await self.load()
+        except Exception as e:
+            logger.exception(e)
+
+
+spend = SpendTracker(
+    window=timedelta(hours=SPEND_WINDOW_HOURS),
+    reconcile_seconds=SPEND_RECONCILE_SECONDS,
+)
@@ -0,0 +1,138 @@
+import time
+
+# taken before anything heavy is imported, main imports this module first
+_started = time.perf_counter()
+
+import asyncio
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional, Set
+
+import aiohttp
+
+from src import metrics
+from src.utils import logger
+
+DISCORD_CHECK_URL = "https://discord.com/api/v10/gateway"
+OPENAI_CHECK_URL = "https://api.openai.com/v1/models"
+CHECK_TIMEOUT_SECONDS = 5
+RETRY_SECONDS = 5
+
+
+class StartupTimer:
+    """Wall time of each startup phase, logged once the bot is ready."""
+
+    def __init__(self, started: float):
+        self.phases: Dict[str, float] = {}
+        self._mark = started
+        self._started = started
+        self._reported = False
+
+    def lap(self, name: str):
+        """Ends a phase that began at the previous lap or phase."""
+        if self._reported:
+            # reconnects run on_ready again, they are not startup
+            return
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        self.lap("other")
+        try:
+            yield
+        finally:
+            self.lap(name)
+
+    def report(self):
+        if self._reported:
+            return
+        self.lap("other")
+        self._reported = True
+        total = time.perf_counter() - self._started
+        breakdown = ", ".join(
+            f"{name} {seconds:.2f}s"
+            for name, seconds in sorted(self.phases.items(), key=lambda p: -p[1])
+            if seconds >= 0.005
+        )
+        logger.info(f"Started in {total:.2f}s: {breakdown}")
+
+
+timer = StartupTimer(_started)
+metrics.Gauge(
+    "jadugpt_startup_seconds",
+    "Seconds spent in each phase of the last startup",
+    ("phase",),
+    fn=lambda: {(name,): seconds for name, seconds in timer.phases.items()},
+)
+
+
+def _session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CHECK_TIMEOUT_SECONDS))
+
+
+async def _reachable(session: aiohttp.ClientSession, url: str) -> Optional[str]:
+    """None if url answered at all, otherwise why not."""
+    try:
+        async with session.head(url, allow_redirects=False) as response:
+            return None if response.status < 500 else f"HTTP {response.status}"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return str(e) or type(e).__name__
+
+
+async def _check_openai() -> Optional[str]:
+    async with _session() as session:
+        return await _reachable(session, OPENAI_CHECK_URL)
+
+
+async def _check_database() -> Optional[str]:
+    from src import db
+
+    try:
+        await db.pool.fetchall("SELECT 1")
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+async def _warm_tokenizer() -> Optional[str]:
+    from src.tokens import tokens
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, tokens.encoding)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+# background checks, referenced so they are not garbage collected mid-run
+_checks: Set[asyncio.Task] = set()
+
+
+async def _log_check(name: str, check: Awaitable[Optional[str]]):
+    error = await check
+    if error is not None:
+        logger.warning(f"{name} is not ready: {error}")
+
+
+async def check_readiness():
+    """Waits until Discord is reachable, the bot cannot run without it.
+
+    OpenAI, MySQL and the tokenizer are checked in background tasks that only
+    log, and are left for the bot's own retries, so a slow or unreachable
+    dependency does not hold up the gateway connection.
+    """
+    for name, check in (
+        ("OpenAI", _check_openai()),
+        ("MySQL", _check_database()),
+        ("Tokenizer", _warm_tokenizer()),
+    ):
+        task = asyncio.create_task(_log_check(name, check))
+        _checks.add(task)
+        task.add_done_callback(_checks.discard)
+    async with _session() as session:
+        error = await _reachable(session, DISCORD_CHECK_URL)
+        while error is not None:
+            logger.warning(f"Discord is not reachable, retrying in {RETRY_SECONDS}s: {error}")
+            await asyncio.sleep(RETRY_SECONDS)
+            error = await _reachable(session, DISCORD_CHECK_URL)
@@ -0,0 +1,246 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.constants import STORE_URL
+from src.utils import logger
+
+Handler = Callable[[str], None]
+
+
+def _member(at: float, amount: float) -> str:
+    # an event added twice is stored once
+    return f"{at!r}:{amount!r}"
+
+
+class Store(ABC):
+    """State shared by every bot process: expiring values, time windows and pub/sub.
+
+    shared is False when each process has its own copy, so anything loaded
+    from the database has to be loaded by every process.
+    """
+
+    shared = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def window_add(self, key: str, events: Iterable[Tuple[float, float]], ttl: float):
+        """Adds (unix time, amount) events to the time window at key."""
+        ...
+
+    @abstractmethod
+    async def window_remove(self, key: str, events: Iterable[Tuple[float, float]]):
+        """Removes events added by window_add, matched exactly."""
+        ...
+
+    @abstractmethod
+    async def window_replace(
+        self, key: str, events: Iterable[Tuple[float, float]], ttl: float, before: float
+    ):
+        """Replaces the events at key older than before with events, newer ones are kept."""
+        ...
+
+    @abstractmethod
+    async def window(self, key: str, since: float) -> Tuple[int, float]:
+        """Number and sum of the events at key since the given unix time."""
+        ...
+
+    @abstractmethod
+    async def window_keys(self, prefix: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, handler: Handler):
+        ...
+
+
+class LocalStore(Store):
+    """In-process stand-in, for running a single process."""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._windows: Dict[str, Dict[str, Tuple[float, float]]] = defaultdict(dict)
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._values[key] = (value, time.time() + ttl if ttl is not None else None)
+
+    async def window_add(self, key: str, events: Iterable[Tuple[float, float]], ttl: float):
+        window = self._windows[key]
+        for at, amount in events:
+            window[_member(at, amount)] = (at, amount)
+        # the window never needs anything older than ttl
+        cutoff = time.time() - ttl
+        for member in [m for m, (at, _) in window.items() if at < cutoff]:
+            del window[member]
+
+    async def window_remove(self, key: str, events: Iterable[Tuple[float, float]]):
+        window = self._windows.get(key)
+        if window is None:
+            return
+        for at, amount in events:
+            window.pop(_member(at, amount), None)
+        if not window:
+            del self._windows[key]
+
+    async def window_replace(
+        self, key: str, events: Iterable[Tuple[float, float]], ttl: float, before: float
+    ):
+        window = self._windows[key]
+        for member in [m for m, (at, _) in window.items() if at < before]:
+            del window[member]
+        await self.window_add(key, events, ttl)
+        if not window:
+            del self._windows[key]
+
+    async def window(self, key: str, since: float) -> Tuple[int, float]:
+        window = self._windows.get(key)
+        if not window:
+            return 0, 0.0
+        amounts = [amount for at, amount in window.values() if at >= since]
+        return len(amounts), sum(amounts)
+
+    async def window_keys(self, prefix: str) -> List[str]:
+        return [key for key in self._windows if key.startswith(prefix)]
+
+    async def publish(self, channel: str, message: str):
+        for handler in self._handlers[channel]:
+            handler(message)
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers[channel].append(handler)
+
+
+class RedisStore(Store):
+    """Redis backed store shared by every process, windows are sorted sets scored by time."""
+
+    shared = True
+
+    def __init__(self, url: str):
+        # optional dependency, only needed when STORE_URL points at redis
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._listener is not None or not self._handlers:
+            return
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(*self._handlers)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    for handler in self._handlers.get(message["channel"], ()):
+                        try:
+                            handler(message["data"])
+                        except Exception as e:
+                            logger.exception(e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        await self._redis.close()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._redis.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    async def window_add(self, key: str, events: Iterable[Tuple[float, float]], ttl: float):
+        mapping = {_member(at, amount): at for at, amount in events}
+        if not mapping:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, mapping)
+            pipe.zremrangebyscore(key, "-inf", f"({time.time() - ttl}")
+            pipe.expire(key, int(ttl) + 1)
+            await pipe.execute()
+
+    async def window_remove(self, key: str, events: Iterable[Tuple[float, float]]):
+        members = [_member(at, amount) for at, amount in events]
+        if members:
+            await self._redis.zrem(key, *members)
+
+    async def window_replace(
+        self, key: str, events: Iterable[Tuple[float, float]], ttl: float, before: float
+    ):
+        mapping = {_member(at, amount): at for at, amount in events}
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", f"({before}")
+            if mapping:
+                pipe.zadd(key, mapping)
+                pipe.expire(key, int(ttl) + 1)
+            await pipe.execute()
+
+    async def window(self, key: str, since: float) -> Tuple[int, float]:
+        members = await self._redis.zrangebyscore(key, since, "+inf")
+        amounts = [float(m.rsplit(":", 1)[1]) for m in members]
+        return len(amounts), sum(amounts)
+
+    async def window_keys(self, prefix: str) -> List[str]:
+        return [key async for key in self._redis.scan_iter(match=f"{prefix}*")]
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(channel, message)
+
+    def subscribe(self, channel: str, handler: Handler):
+        # handlers are registered before start(), which opens the subscription
+        self._handlers[channel].append(handler)
+
+
+def create_store(url: Optional[str]) -> Store:
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    if url:
+        raise ValueError(f"Unsupported STORE_URL {url}")
+    return LocalStore()
+
+
+store = create_store(STORE_URL)
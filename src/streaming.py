@@ -0,0 +1,62 @@
+import time
+from typing import List
+
+import discord
+from discord import Message as DiscordMessage
+
+from src import metrics
+from src.constants import STREAM_EDIT_INTERVAL_SECONDS
+from src.utils import split_into_shorter_messages, logger
+
+
+class StreamingReply:
+    """Renders a reply into a thread while it is still being generated.
+
+    The last message is edited as text arrives, at most once per
+    min_interval, and a new message is started each time the text crosses
+    MAX_CHARS_PER_REPLY_MSG.
+    """
+
+    def __init__(self, thread: discord.Thread, min_interval: float = STREAM_EDIT_INTERVAL_SECONDS):
+        self.thread = thread
+        self.min_interval = min_interval
+        self.sent: List[DiscordMessage] = []
+        self._shown: List[str] = []
+        self._parts: List[str] = []
+        self._last_render = 0.0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    async def _render(self):
+        chunks = split_into_shorter_messages(self.text)
+        with metrics.stage("discord_stream_edit"):
+            for i, chunk in enumerate(chunks):
+                if i < len(self.sent):
+                    if self._shown[i] != chunk:
+                        await self.sent[i].edit(content=chunk)
+                        self._shown[i] = chunk
+                else:
+                    self.sent.append(await self.thread.send(chunk))
+                    self._shown.append(chunk)
+        self._last_render = time.monotonic()
+
+    async def feed(self, delta: str):
+        self._parts.append(delta)
+        if time.monotonic() - self._last_render >= self.min_interval:
+            await self._render()
+
+    async def finish(self) -> str:
+        await self._render()
+        return self.text
+
+    async def discard(self):
+        """Deletes whatever was already shown, e.g. when the reply is blocked."""
+        for message in self.sent:
+            try:
+                await message.delete()
+            except discord.HTTPException as e:
+                logger.exception(e)
+        self.sent = []
+        self._shown = []
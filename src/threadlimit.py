@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src import db
+from src.constants import THREAD_LIMIT, THREAD_LIMIT_WINDOW_SECONDS
+from src.store import store
+from src.utils import logger
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S.%f")
+
+
+class ThreadLimiter:
+    """Counts the /chat threads each user started inside the window.
+
+    Counts live in the shared store so the limit holds across bot processes,
+    JaduThreads stays the record and seeds the store on start. /allow lifts
+    the limit until the user's most recent thread leaves the window.
+    """
+
+    def __init__(self, limit: int, window_seconds: float):
+        self.limit = limit
+        self.window = timedelta(seconds=window_seconds)
+        self._loaded = False
+
+    async def allowed(self, user_id) -> bool:
+        if await store.get(f"threads:allow:{user_id}") is not None:
+            return True
+        since = (datetime.now() - self.window).timestamp()
+        count, _ = await store.window(f"threads:{user_id}", since)
+        return count < self.limit
+
+    async def started(self, user_id, at: datetime):
+        await store.window_add(
+            f"threads:{user_id}", [(at.timestamp(), 1)], self.window.total_seconds()
+        )
+
+    async def allow(self, user_id, most_recent: Optional[datetime]):
+        if most_recent is None:
+            return
+        ttl = (most_recent + self.window - datetime.now()).total_seconds()
+        if ttl > 0:
+            await store.set(f"threads:allow:{user_id}", "1", ttl=ttl)
+
+    async def load(self):
+        rows = await db.pool.fetchall(
+            "SELECT Date, UserID, allowed FROM JaduThreads WHERE Date >= %s",
+            (str(datetime.now() - self.window),),
+        )
+        for at, user_id, allowed in rows:
+            at = _to_datetime(at)
+            await self.started(user_id, at)
+            if allowed == "allow":
+                await self.allow(user_id, at)
+        logger.info(f"Loaded {len(rows)} recent threads")
+
+    async def start(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            await self.load()
+        except Exception as e:
+            logger.exception(e)
+
+
+thread_limiter = ThreadLimiter(limit=THREAD_LIMIT, window_seconds=THREAD_LIMIT_WINDOW_SECONDS)
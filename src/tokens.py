@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+import tiktoken
+
+from src import metrics
+from src.cache import LRUCache
+from src.constants import TIKTOKEN_CACHE_DIR, TOKEN_COUNT_CACHE_SIZE
+
+DEFAULT_MODEL = "gpt-4"
+PREFETCH_ENCODINGS = ("cl100k_base",)
+
+# tiktoken reads this when an encoding is first loaded, instead of a temp dir
+os.environ["TIKTOKEN_CACHE_DIR"] = TIKTOKEN_CACHE_DIR
+
+
+@dataclass(frozen=True)
+class TurnTokens:
+    per_message: List[int]
+    total: int
+
+
+class TokenCounter:
+    """Counts tokens with one encoder per model and memoizes every text.
+
+    Counts are keyed by encoding and a hash of the text, so a thread's
+    history is only tokenized once no matter how many turns reuse it. Cache
+    misses from the async helpers are encoded in a batch off the event loop.
+    """
+
+    def __init__(self, cache_size: int):
+        self._encodings: Dict[str, tiktoken.Encoding] = {}
+        self._counts = LRUCache(cache_size)
+
+    def encoding(self, model: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+        encoding = self._encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            self._encodings[model] = encoding
+        return encoding
+
+    @staticmethod
+    def _key(encoding: tiktoken.Encoding, text: str):
+        return (encoding.name, hashlib.blake2b(text.encode(), digest_size=16).digest())
+
+    def count(self, text: str, model: str = DEFAULT_MODEL) -> int:
+        encoding = self.encoding(model)
+        key = self._key(encoding, text)
+        count = self._counts.get(key)
+        if count is None:
+            count = len(encoding.encode(text, disallowed_special=()))
+            self._counts.set(key, count)
+        return count
+
+    async def count_many(self, texts: List[str], model: str = DEFAULT_MODEL) -> List[int]:
+        encoding = self.encoding(model)
+        keys = [self._key(encoding, text) for text in texts]
+        counts = [self._counts.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            loop = asyncio.get_running_loop()
+            with metrics.stage("token_counting"):
+                encoded = await loop.run_in_executor(
+                    None,
+                    lambda: encoding.encode_batch(
+                        [texts[i] for i in missing], disallowed_special=()
+                    ),
+                )
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                self._counts.set(keys[i], counts[i])
+        return counts
+
+
+tokens = TokenCounter(cache_size=TOKEN_COUNT_CACHE_SIZE)
+
+
+if __name__ == "__main__":
+    # downloads the encodings into TIKTOKEN_CACHE_DIR, e.g. while building an image
+    for name in PREFETCH_ENCODINGS:
+        tiktoken.get_encoding(name)
+    print(f"Cached {', '.join(PREFETCH_ENCODINGS)} in {TIKTOKEN_CACHE_DIR}")
@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import json
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, TextIO
+
+from src.constants import TRACE_FILE, TRACE_SAMPLE_RATE
+from src.utils import logger
+
+_current: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+_file: Optional[TextIO] = None
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    sampled: bool
+    start: float = field(default_factory=time.time)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+def _emit(span: Span, duration: float, status: str):
+    global _file
+    record = {
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "name": span.name,
+        "start": round(span.start, 6),
+        "duration_ms": round(duration * 1000, 3),
+        "status": status,
+        **span.attributes,
+    }
+    try:
+        if _file is None:
+            _file = open(TRACE_FILE, "a", buffering=1, encoding="utf-8")
+        _file.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write trace to {TRACE_FILE}: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times the block as a span of the current trace, or starts a trace if there is none.
+
+    Spans are written as JSON lines to TRACE_FILE when their trace is sampled.
+    Without TRACE_FILE this does nothing.
+    """
+    if not TRACE_FILE:
+        yield None
+        return
+    parent = _current.get()
+    if parent is None:
+        trace_id = secrets.token_hex(8)
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    else:
+        trace_id = parent.trace_id
+        sampled = parent.sampled
+    current = Span(
+        trace_id=trace_id,
+        span_id=secrets.token_hex(4),
+        parent_id=parent.span_id if parent else None,
+        name=name,
+        sampled=sampled,
+        attributes=attributes,
+    )
+    token = _current.set(current)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException as e:
+        status = "error"
+        current.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        if sampled:
+            _emit(current, time.perf_counter() - started, status)
+
+
+def traced(name: str):
+    """Decorates a coroutine function to run it inside a span."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def annotate(**attributes):
+    """Adds attributes, e.g. model or token counts, to the current span."""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def close():
+    global _file
+    if _file is not None:
+        _file.close()
+        _file = None
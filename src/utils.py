@@ -6,7 +6,7 @@ import logging
 logger = logging.getLogger(__name__)
 from src.base import Message
 from discord import Message as DiscordMessage
-from typing import Optional, List
+from typing import Awaitable, Callable, Optional, List
 import discord
 
 from src.constants import MAX_CHARS_PER_REPLY_MSG, INACTIVATE_THREAD_PREFIX
@@ -57,6 +57,24 @@ async def close_thread(thread: discord.Thread):
     await thread.edit(archived=True, locked=True)
 
 
+def has_queue_priority(user) -> bool:
+    """Moderators skip the fair queue so they can still act when it is busy."""
+    permissions = getattr(user, "guild_permissions", None)
+    return bool(permissions and permissions.manage_messages)
+
+
+def queue_notifier(thread: discord.Thread) -> Callable[[int], Awaitable]:
+    async def notify(position: int):
+        await thread.send(
+            embed=discord.Embed(
+                description=f"⏳ Lots of requests right now, you are #{position} in the queue.",
+                color=discord.Color.blue(),
+            )
+        )
+
+    return notify
+
+
 def should_block(guild: Optional[discord.Guild]) -> bool:
     if guild is None:
         # dm's not supported
@@ -0,0 +1,68 @@
+import asyncio
+import inspect
+import os
+
+import pytest
+
+# src.constants reads these at import
+os.environ.setdefault("DISCORD_BOT_TOKEN", "test")
+os.environ.setdefault("DISCORD_CLIENT_ID", "1")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ALLOWED_SERVER_IDS", "1")
+os.environ.setdefault("SERVER_TO_MODERATION_CHANNEL", "1:2")
+os.environ.setdefault("METRICS_PORT", "0")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Runs async def tests on a fresh event loop."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    names = pyfuncitem._fixtureinfo.argnames
+    asyncio.run(pyfuncitem.obj(**{name: pyfuncitem.funcargs[name] for name in names}))
+    return True
+
+
+class FakePool:
+    """Stands in for src.db.pool.
+
+    fetchall returns rows and writes are appended to written. The next fail
+    calls raise, and writes wait until release is set.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.written = []
+        self.fail = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    def _maybe_fail(self):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("down")
+
+    async def fetchall(self, sql, args=None):
+        self._maybe_fail()
+        return tuple(self.rows)
+
+    async def execute(self, sql, args=None):
+        await self.release.wait()
+        self._maybe_fail()
+        self.written.append(args)
+        return 1
+
+    async def executemany(self, sql, rows):
+        await self.release.wait()
+        self._maybe_fail()
+        self.written.extend(rows)
+        return len(rows)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    from src import db
+
+    fake = FakePool()
+    monkeypatch.setattr(db, "pool", fake)
+    return fake
@@ -0,0 +1,22 @@
+from src.blocklist import BlockList
+
+
+async def test_fails_closed_until_loaded(pool):
+    pool.rows = [("7",)]
+    pool.fail = 1
+    blocklist = BlockList(refresh_seconds=300)
+    await blocklist._load_or_log()
+    assert blocklist.is_blocked(1)
+    await blocklist._load_or_log()
+    assert not blocklist.is_blocked(1)
+    assert blocklist.is_blocked(7)
+
+
+async def test_failed_reload_keeps_last_good_set(pool):
+    pool.rows = [("7",)]
+    blocklist = BlockList(refresh_seconds=300)
+    await blocklist.load()
+    pool.fail = 1
+    await blocklist._load_or_log()
+    assert blocklist.is_blocked(7)
+    assert not blocklist.is_blocked(1)
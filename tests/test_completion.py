@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src import completion, openai_client
+from src.completion import CompletionResult
+from src.resilience import CircuitOpen
+from src.scheduler import FairScheduler, _ModelQueue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    scheduler = FairScheduler()
+    queue = scheduler._models["m"] = _ModelQueue("m", rpm=600, tpm=10000)
+    monkeypatch.setattr(completion, "scheduler", scheduler)
+
+    async def build_context(pinned, turns, model):
+        return SimpleNamespace(messages=[], prompt_tokens=100, max_output_tokens=4000, dropped=0)
+
+    monkeypatch.setattr(completion, "build_context", build_context)
+    return queue
+
+
+def failing_with(e):
+    async def chat_completion(*args, **kwargs):
+        raise e
+
+    return chat_completion
+
+
+@pytest.mark.parametrize(
+    "error, status, used",
+    [
+        (CircuitOpen("openai", 30), CompletionResult.UNAVAILABLE, 0),
+        (openai_client.ModelBusy("busy"), CompletionResult.OTHER_ERROR, 0),
+        (RuntimeError("HTTP 500"), CompletionResult.OTHER_ERROR, 100),
+    ],
+)
+async def test_failed_request_gives_back_its_budget(queue, monkeypatch, error, status, used):
+    monkeypatch.setattr(openai_client, "chat_completion", failing_with(error))
+    result = await completion.generate_completion_response(
+        [], SimpleNamespace(id=1), gptmodel="m"
+    )
+    assert result.status == status
+    assert abs(queue.tokens.level - (10000 - used)) < 1
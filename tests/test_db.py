@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from bench import database
+from src.db import ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = os.path.join(tmp_path, "test.sqlite3")
+    database.create(path)
+    return database.connect_factory(path, database.QueryCounter())
+
+
+async def test_queries_reuse_connections(connect):
+    pool = ConnectionPool(1, 2, acquire_timeout=1, health_check_seconds=60, connect=connect)
+    await pool.start()
+    await pool.execute(
+        "INSERT INTO JaduThreads (Date, UserID) VALUES (%s, %s)", ("2024-01-01", "1")
+    )
+    await pool.executemany(
+        "INSERT INTO JaduThreads (Date, UserID) VALUES (%s, %s)",
+        [("2024-01-02", "2"), ("2024-01-03", "3")],
+    )
+    rows = await pool.fetchall("SELECT UserID FROM JaduThreads ORDER BY Date")
+    assert [r[0] for r in rows] == ["1", "2", "3"]
+    assert pool.metrics.size == 1
+    assert pool.metrics.in_use == 0
+    await pool.close()
+
+
+async def test_acquire_times_out_when_exhausted(connect):
+    pool = ConnectionPool(0, 1, acquire_timeout=0.05, health_check_seconds=60, connect=connect)
+    async with pool.acquire():
+        with pytest.raises(PoolTimeout):
+            async with pool.acquire():
+                pass
+    assert pool.metrics.acquire_timeouts == 1
+    await pool.close()
+
+
+async def test_failed_query_discards_connection(connect):
+    pool = ConnectionPool(0, 2, acquire_timeout=1, health_check_seconds=60, connect=connect)
+    with pytest.raises(Exception):
+        await pool.fetchall("SELECT * FROM no_such_table")
+    assert pool.metrics.size == 0
+    assert await pool.fetchall("SELECT 1") == ((1,),)
+    await pool.close()
+
+
+class Dead:
+    def ping(self):
+        raise ConnectionError("gone")
+
+    def close(self):
+        pass
+
+
+async def test_stale_connection_is_pinged_and_replaced(connect):
+    pool = ConnectionPool(0, 2, acquire_timeout=1, health_check_seconds=0, connect=connect)
+    pool.metrics.size = 1
+    pool._idle.append((Dead(), 0.0))
+    assert await pool.fetchall("SELECT 1") == ((1,),)
+    assert pool.metrics.health_check_failures == 1
+    assert pool.metrics.size == 1
+    await pool.close()
@@ -0,0 +1,42 @@
+import asyncio
+
+from src.debounce import ThreadDebouncer
+
+
+async def test_newer_job_replaces_waiting_one():
+    debouncer = ThreadDebouncer(delay=0.02)
+    ran = []
+
+    async def job(n):
+        ran.append(n)
+
+    debouncer.submit(1, lambda: job("first"))
+    debouncer.submit(1, lambda: job("second"))
+    task = debouncer.submit(2, lambda: job("other thread"))
+    assert debouncer.pending == 2
+    await asyncio.sleep(0.05)
+    await task
+    assert sorted(ran) == ["other thread", "second"]
+    assert debouncer.pending == 0
+
+
+async def test_newer_job_cancels_running_one():
+    debouncer = ThreadDebouncer(delay=0)
+    started, cancelled = asyncio.Event(), []
+
+    async def slow():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast():
+        pass
+
+    debouncer.submit(1, slow)
+    await started.wait()
+    await debouncer.submit(1, fast)
+    await asyncio.sleep(0)
+    assert cancelled == [True]
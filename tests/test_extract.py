@@ -0,0 +1,27 @@
+from src.extract import extract_text
+
+
+def test_visible_text_only():
+    html = b"""<html><head><title>Title</title><style>p {}</style></head>
+    <body><nav>Menu</nav><p>Hello   <b>world</b></p><script>var x;</script></body></html>"""
+    assert extract_text(html, 1000) == "Hello world"
+
+
+def test_head_without_end_tag():
+    html = b"<html><head><title>T</title><body><p>Hello world</p></body></html>"
+    assert extract_text(html, 1000) == "Hello world"
+
+
+def test_void_tags_do_not_open_skipped_region():
+    html = b"<head><meta charset=utf-8><link rel=stylesheet></head><p>kept</p>"
+    assert extract_text(html, 1000) == "kept"
+
+
+def test_stops_at_max_chars():
+    html = b"<p>" + b"word " * 1000 + b"</p>"
+    assert len(extract_text(html, 50)) <= 50
+
+
+def test_encoding():
+    assert extract_text("<p>café</p>".encode("latin-1"), 100, "latin-1") == "café"
+    assert extract_text(b"<p>ok</p>", 100, "no-such-codec") == "ok"
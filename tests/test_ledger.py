@@ -0,0 +1,53 @@
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+from src.ledger import LedgerWriter
+
+
+def user(n):
+    return SimpleNamespace(id=n)
+
+
+async def test_flushes_in_batches(pool):
+    writer = LedgerWriter(batch_size=2, flush_seconds=60, max_buffered_rows=100)
+    writer.start()
+    for i in range(5):
+        writer.record(user(i), Decimal("0.01"))
+    await asyncio.sleep(0.01)
+    assert len(pool.written) >= 4
+    await writer.close()
+    assert len(pool.written) == 5
+    assert writer.pending == 0
+
+
+async def test_close_waits_for_write_in_progress(pool):
+    pool.release.clear()
+    writer = LedgerWriter(batch_size=1, flush_seconds=60, max_buffered_rows=100)
+    writer.start()
+    writer.record(user(1), Decimal("0.5"))
+    await asyncio.sleep(0.01)
+    # the batch has left the buffer and the write is in progress
+    assert writer.pending == 0
+    closing = asyncio.create_task(writer.close())
+    await asyncio.sleep(0.01)
+    pool.release.set()
+    await closing
+    assert [row[1] for row in pool.written] == ["1"]
+
+
+async def test_failed_batch_is_retried(pool):
+    pool.fail = 1
+    writer = LedgerWriter(batch_size=10, flush_seconds=60, max_buffered_rows=100)
+    writer.record(user(1), Decimal("0.5"))
+    assert not await writer.flush()
+    assert writer.pending == 1
+    assert await writer.flush()
+    assert len(pool.written) == 1
+
+
+async def test_buffer_drops_oldest_rows():
+    writer = LedgerWriter(batch_size=100, flush_seconds=60, max_buffered_rows=3)
+    for i in range(5):
+        writer.record(user(i), Decimal("0.01"))
+    assert writer.pending == 3
@@ -0,0 +1,53 @@
+import pytest
+
+from bench.fakes import FakeGuild, FakeTextChannel, FakeUser
+from src import main
+from src.blocklist import BlockList
+from src.constants import ALLOWED_SERVER_IDS
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    bot = FakeUser("JaduGPT")
+    monkeypatch.setattr(main.client._connection, "user", bot)
+    guild = FakeGuild(id=ALLOWED_SERVER_IDS[0])
+    dispatched = []
+    channel = FakeTextChannel(
+        guild, "general", lambda event, message: dispatched.append((event, message))
+    )
+    channel.bot_user = bot
+    channel.dispatched = dispatched
+    return channel
+
+
+async def deliver(channel, limit=20):
+    """Feeds dispatched messages to on_message until the channel goes quiet."""
+    for _ in range(limit):
+        messages = [m for event, m in channel.dispatched if event == "message"]
+        channel.dispatched.clear()
+        if not messages:
+            return
+        for message in messages:
+            await main.on_message(message)
+    raise AssertionError("the bot kept answering itself")
+
+
+def bot_sends(channel):
+    return [e for e in channel.events if e.kind == "send"]
+
+
+async def test_stays_quiet_until_blocklist_loaded(channel, monkeypatch):
+    monkeypatch.setattr(main, "blocklist", BlockList(refresh_seconds=300))
+    channel.say(FakeUser("someone"), "hello")
+    await deliver(channel)
+    assert bot_sends(channel) == []
+
+
+async def test_blocked_user_is_told_once(channel, monkeypatch, pool):
+    pool.rows = [("7",)]
+    blocklist = BlockList(refresh_seconds=300)
+    await blocklist.load()
+    monkeypatch.setattr(main, "blocklist", blocklist)
+    channel.say(FakeUser("blocked", id=7), "hello")
+    await deliver(channel)
+    assert len(bot_sends(channel)) == 1
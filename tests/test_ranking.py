@@ -0,0 +1,29 @@
+from src.ranking import bm25_scores, chunk_text, terms
+
+
+def test_terms():
+    assert terms("Hello, WORLD! it's") == ["hello", "world", "it", "s"]
+
+
+def test_chunk_text_overlaps():
+    words = [str(i) for i in range(250)]
+    chunks = chunk_text(" ".join(words), size=100, overlap=20)
+    assert [c.split()[0] for c in chunks] == ["0", "80", "160"]
+    assert chunks[-1].split()[-1] == "249"
+    assert chunk_text("short text", size=100, overlap=20) == ["short text"]
+
+
+def test_bm25_prefers_matching_and_rarer_terms():
+    documents = [
+        "the jadu hoverboard flies over the city",
+        "the weather is nice and the sky is blue",
+        "jadu jetpack and jadu hoverboard owners",
+    ]
+    scores = bm25_scores("jadu hoverboard", documents)
+    assert scores[1] == 0
+    assert scores[2] > scores[0] > 0
+
+
+def test_bm25_empty_inputs():
+    assert bm25_scores("anything", []) == []
+    assert bm25_scores("", ["a document"]) == [0.0]
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from yarl import URL
+
+from src import resilience
+from src.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+REQUEST = aiohttp.RequestInfo(URL("http://test"), "GET", {}, URL("http://test"))
+
+
+def response_error(status, headers=None):
+    return aiohttp.ClientResponseError(REQUEST, (), status=status, headers=headers)
+
+
+def test_breaker_opens_after_threshold_and_probes_after_reset():
+    circuit = CircuitBreaker("test", failure_threshold=2, reset_seconds=0.05)
+    circuit.failure()
+    assert circuit.state == CLOSED
+    circuit.failure()
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpen):
+        circuit.before()
+    assert circuit.rejected == 1
+    time.sleep(0.06)
+    assert circuit.before() is True
+    assert circuit.state == HALF_OPEN
+    # only one probe at a time
+    with pytest.raises(CircuitOpen):
+        circuit.before()
+    circuit.success()
+    assert circuit.state == CLOSED
+    assert circuit.before() is False
+
+
+def test_failed_probe_reopens():
+    circuit = CircuitBreaker("test", failure_threshold=5, reset_seconds=0)
+    for _ in range(5):
+        circuit.failure()
+    assert circuit.before() is True
+    circuit.failure()
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 2
+
+
+def test_is_transient():
+    assert resilience.is_transient(response_error(429))
+    assert resilience.is_transient(response_error(503))
+    assert not resilience.is_transient(response_error(400))
+    assert resilience.is_transient(aiohttp.ClientConnectionError())
+    assert resilience.is_transient(asyncio.TimeoutError())
+    assert not resilience.is_transient(ValueError())
+
+
+def test_retry_after():
+    assert resilience.retry_after(response_error(429, {"Retry-After": "3"})) == 3
+    assert resilience.retry_after(response_error(429, {"retry-after-ms": "250"})) == 0.25
+    assert resilience.retry_after(response_error(429, {})) is None
+    date = resilience.retry_after(response_error(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}))
+    assert date == 0
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(resilience, "backoff", lambda attempt: 0)
+    name = f"test-{id(monkeypatch)}"
+    yield name
+    resilience._breakers.pop(name, None)
+
+
+async def test_call_retries_transient_failures(endpoint):
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        if len(calls) < 3:
+            raise response_error(503)
+        return "ok"
+
+    assert await resilience.call(endpoint, attempt) == "ok"
+    assert len(calls) == 3
+    assert resilience.breaker(endpoint).state == CLOSED
+
+
+async def test_call_does_not_retry_client_errors(endpoint):
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise response_error(400)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        await resilience.call(endpoint, attempt)
+    assert len(calls) == 1
+
+
+async def test_call_gives_up_after_attempts_and_fails_fast(endpoint, monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 3)
+
+    async def attempt():
+        raise response_error(500)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        await resilience.call(endpoint, attempt)
+    assert resilience.breaker(endpoint).state == OPEN
+    with pytest.raises(CircuitOpen):
+        await resilience.call(endpoint, attempt)
+
+
+async def test_long_retry_after_fails_instead_of_waiting(endpoint):
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise response_error(429, {"Retry-After": "3600"})
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        await resilience.call(endpoint, attempt)
+    assert len(calls) == 1
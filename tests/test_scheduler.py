@@ -0,0 +1,87 @@
+import asyncio
+
+from src.scheduler import FairScheduler, TokenBucket, _ModelQueue
+
+
+def test_token_bucket():
+    bucket = TokenBucket(capacity=10, per_second=100)
+    assert bucket.wait_time(10) == 0
+    bucket.take(10)
+    assert 0 < bucket.wait_time(5) <= 0.05
+    bucket.give_back(100)
+    assert bucket.level == 10
+
+
+def scheduler_with(rpm=600, tpm=10**6):
+    scheduler = FairScheduler()
+    queue = _ModelQueue("m", rpm, tpm)
+    scheduler._models["m"] = queue
+    return scheduler, queue
+
+
+async def test_admits_immediately_with_budget():
+    scheduler, queue = scheduler_with()
+    async with scheduler.admit("m", "a", 100) as admission:
+        assert admission.estimated_tokens == 100
+    assert queue.tokens.level < queue.tokens.capacity
+
+
+async def test_round_robin_between_keys_with_priority_first():
+    scheduler, queue = scheduler_with(rpm=1200)  # 20 requests a second
+    queue.requests.level = 0
+    order = []
+
+    async def request(key, priority=False):
+        async with scheduler.admit("m", key, 10, priority=priority):
+            order.append(key)
+
+    tasks = [asyncio.create_task(request(k)) for k in ("a", "a", "a", "b")]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(request("mod", priority=True)))
+    await asyncio.gather(*tasks)
+    assert order == ["mod", "a", "b", "a", "a"]
+
+
+async def test_position_and_queued_callback():
+    scheduler, queue = scheduler_with(rpm=1200)
+    queue.requests.level = 0
+    positions = []
+
+    async def on_queued(position):
+        positions.append(position)
+
+    async def request(key):
+        async with scheduler.admit("m", key, 10, on_queued=on_queued):
+            pass
+
+    await asyncio.gather(request("a"), request("a"), request("b"))
+    assert positions == [1, 2, 2]
+
+
+async def test_cancelled_request_is_skipped():
+    scheduler, queue = scheduler_with(rpm=1200)
+    queue.requests.level = 0
+    order = []
+
+    async def request(key):
+        async with scheduler.admit("m", key, 10):
+            order.append(key)
+
+    first = asyncio.create_task(request("a"))
+    second = asyncio.create_task(request("b"))
+    await asyncio.sleep(0)
+    first.cancel()
+    await second
+    assert order == ["b"]
+    assert queue.depth == 0
+
+
+async def test_settle_corrects_the_estimate():
+    scheduler, queue = scheduler_with(tpm=1000)
+    async with scheduler.admit("m", "a", 500) as admission:
+        pass
+    scheduler.settle(admission, 100)
+    assert abs(queue.tokens.level - 900) < 1
+    # settling twice changes nothing
+    scheduler.settle(admission, 1000)
+    assert abs(queue.tokens.level - 900) < 1
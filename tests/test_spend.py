@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from src.ledger import LedgerWriter
+from src.spend import SpendTracker, _key, _unwritten_key
+from src.store import store
+
+
+@pytest.fixture
+def spend(pool, monkeypatch):
+    # the primary process's own ledger, with nothing buffered
+    monkeypatch.setattr("src.ledger.ledger", LedgerWriter(10, 60, 100))
+    return SpendTracker(window=timedelta(hours=24), reconcile_seconds=600)
+
+
+async def test_reconcile_does_not_double_count(spend, pool):
+    at = datetime.now() - timedelta(hours=1)
+    spend.record("501", 0.3, at=at)
+    await asyncio.sleep(0)
+    await spend.written([("501", 0.3, at)])
+    # DATETIME without fractional seconds and a FLOAT cost column
+    pool.rows = [("501", 0.30000001, at.replace(microsecond=0))]
+    await spend.load()
+    await spend.load()
+    assert abs(await spend.total("501") - 0.3) < 1e-6
+
+
+async def test_reconcile_removes_written_events_gone_from_table(spend):
+    at = datetime.now() - timedelta(hours=2)
+    spend.record("502", 1.0, at=at)
+    spend.record("502", 0.25)
+    await asyncio.sleep(0)
+    await spend.written([("502", 1.0, at)])
+    await spend.load()
+    assert await spend.total("502") == 0.25
+
+
+async def test_first_load_includes_the_last_minute(spend, pool):
+    pool.rows = [("503", 0.5, datetime.now() - timedelta(seconds=10))]
+    await spend.load()
+    assert await spend.total("503") == 0.5
+
+
+async def test_rows_buffered_by_another_process_survive_reconcile(spend):
+    # buffered in a non-primary process during a database outage
+    other = LedgerWriter(10, 60, 100)
+    other.record(SimpleNamespace(id=504), Decimal("0.4"), at=datetime.now() - timedelta(hours=1))
+    await asyncio.sleep(0)
+    await spend.load()
+    assert abs(await spend.total("504") - 0.4) < 1e-9
+
+
+async def test_flush_moves_rows_to_the_main_window(spend, pool):
+    ledger = LedgerWriter(10, 60, 100)
+    ledger.record(SimpleNamespace(id=505), Decimal("0.2"))
+    await asyncio.sleep(0)
+    assert await ledger.flush()
+    assert (await store.window(_unwritten_key(505), 0))[0] == 0
+    assert (await store.window(_key(505), 0))[0] == 1
+    assert abs(await spend.total(505) - 0.2) < 1e-9
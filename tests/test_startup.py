@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from src import startup
+
+
+async def test_readiness_waits_only_for_discord(monkeypatch):
+    checked = []
+
+    async def reachable(session, url):
+        checked.append(url)
+        return None
+
+    async def slow():
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(startup, "_reachable", reachable)
+    monkeypatch.setattr(startup, "_check_database", slow)
+    monkeypatch.setattr(startup, "_warm_tokenizer", slow)
+    started = time.perf_counter()
+    await startup.check_readiness()
+    assert time.perf_counter() - started < 1
+    assert startup.DISCORD_CHECK_URL in checked
+    # the slow checks carry on in the background
+    assert len([task for task in startup._checks if not task.done()]) >= 2
+    for task in list(startup._checks):
+        task.cancel()
+
+
+async def test_background_check_failures_are_logged(monkeypatch, caplog):
+    async def down():
+        return "connection refused"
+
+    await startup._log_check("MySQL", down())
+    assert "MySQL is not ready: connection refused" in caplog.text
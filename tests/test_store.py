@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+
+from src.store import LocalStore, Store
+
+
+async def test_window_counts_and_sums_since():
+    store = LocalStore()
+    now = time.time()
+    await store.window_add("k", [(now - 30, 1.0), (now - 10, 2.0), (now, 4.0)], ttl=60)
+    assert await store.window("k", now - 20) == (2, 6.0)
+    assert await store.window("k", now - 60) == (3, 7.0)
+    assert await store.window("missing", 0) == (0, 0.0)
+
+
+async def test_window_add_is_idempotent_and_trims():
+    store = LocalStore()
+    now = time.time()
+    await store.window_add("k", [(now, 1.5), (now, 1.5), (now - 120, 9.0)], ttl=60)
+    assert await store.window("k", 0) == (1, 1.5)
+
+
+async def test_window_replace_keeps_newer_events():
+    store = LocalStore()
+    now = time.time()
+    await store.window_add("k", [(now - 50, 1.0), (now - 40, 1.0), (now - 5, 2.0)], ttl=60)
+    await store.window_replace("k", [(now - 45, 0.5)], ttl=60, before=now - 30)
+    assert await store.window("k", 0) == (2, 2.5)
+    await store.window_replace("k", [], ttl=60, before=now)
+    assert await store.window("k", 0) == (0, 0.0)
+    assert await store.window_keys("k") == []
+
+
+async def test_window_remove_matches_exactly():
+    store = LocalStore()
+    now = time.time()
+    await store.window_add("k", [(now, 0.1), (now - 1, 0.2)], ttl=60)
+    await store.window_remove("k", [(now, 0.1), (now, 0.3)])
+    assert await store.window("k", 0) == (1, 0.2)
+    await store.window_remove("k", [(now - 1, 0.2)])
+    assert await store.window_keys("k") == []
+
+
+async def test_values_expire():
+    store = LocalStore()
+    await store.set("a", "1", ttl=0.01)
+    await store.set("b", "2")
+    assert await store.get("a") == "1"
+    await asyncio.sleep(0.02)
+    assert await store.get("a") is None
+    assert await store.get("b") == "2"
+
+
+async def test_publish_reaches_subscribers():
+    store = LocalStore()
+    received = []
+    store.subscribe("c", received.append)
+    await store.publish("c", "hello")
+    await store.publish("other", "ignored")
+    assert received == ["hello"]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class Partial(Store):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()